@@ -0,0 +1,156 @@
+import numpy as np
+from dataset import PlayerTable
+from prefilter import filter_players
+from search import CondBound, PathSearch, with_repeats
+from utils import STATS, positions_mask, playstyles_mask
+
+'''
+Batch queries - many conditions sets (each one the conditions of Player.eval_cond) answered by one search pass.
+The paths of each base player are searched once, pruned only where no query can be met anymore, and the evolved
+players at the paths ends are matched with all the queries at once: the queries are compiled to a predicate matrix
+(a column per query) and the found players are matched in chunks with vectorized comparisons, so the search cost
+grows with the states found and not with states times queries.
+'''
+
+CHUNK_SIZE = 4096  # Found players matched together
+
+
+# Conditions sets compiled to columns - one entry per query, 'any' where the query has no such condition
+class QueryMatrix:
+    def __init__(self, conds: list, evo_list: list):
+        self.n_queries = len(conds)
+        self.min_stats = np.array([[cond.get(f"min{stat}", 0) for stat in STATS] +  # STATS order, skills and wf
+                                   [cond.get('min_skills', 0), cond.get('min_wf', 0)] for cond in conds],
+                                  dtype=np.int16).reshape(self.n_queries, len(STATS) + 2)
+        self.any_positions = np.array([cond.get('wanted_positions') is None for cond in conds], dtype=bool)
+        self.positions = np.array([positions_mask(frozenset(cond.get('wanted_positions') or ())) for cond in conds],
+                                  dtype=np.int64)
+        self.any_playstyles = np.array([cond.get('wanted_playstyles') is None for cond in conds], dtype=bool)
+        self.playstyles = np.array([playstyles_mask(frozenset(cond.get('wanted_playstyles') or ()))
+                                    for cond in conds], dtype=np.int64)
+        self.strs = {key: np.array([cond.get(key, '') for cond in conds], dtype=str)  # '' - any
+                     for key in ('playstyle_plus', 'att_wr', 'def_wr')}
+        self.names = [(q, cond['name']) for q, cond in enumerate(conds) if cond.get('name', '') != '']
+
+        self.evo_idx = {evolution.name: i for i, evolution in enumerate(evo_list)}
+        self.any_evos = np.array([cond.get('wanted_evos') is None for cond in conds], dtype=bool)
+        self.wanted_evos = np.zeros((len(evo_list), self.n_queries), dtype=np.int16)  # Evolution x query
+        for q, cond in enumerate(conds):
+            for evolution in cond.get('wanted_evos') or ():
+                if evolution.name in self.evo_idx:  # Evolutions out of the list are never done
+                    self.wanted_evos[self.evo_idx[evolution.name], q] = 1
+
+    # Boolean matrix of evolved players x queries - True where the player meets the query
+    def match(self, players: list):
+        n_players = len(players)
+        stats = np.array([_player.stat_vector() + (_player.skills, _player.wf) for _player in players],
+                         dtype=np.int16).reshape(n_players, len(STATS) + 2)
+        met = (stats[:, None, :] >= self.min_stats[None, :, :]).all(axis=2)
+
+        positions = np.fromiter((_player.positions for _player in players), dtype=np.int64, count=n_players)
+        met &= self.any_positions | ((positions[:, None] & self.positions) != 0)
+        playstyles = np.fromiter((_player.playstyles for _player in players), dtype=np.int64, count=n_players)
+        met &= self.any_playstyles | ((playstyles[:, None] & self.playstyles) != 0)
+
+        for key, wanted in self.strs.items():
+            if (wanted != '').any():
+                values = np.array([getattr(_player, key) for _player in players], dtype=str)
+                met &= (wanted == '') | (values[:, None] == wanted)
+
+        if self.names:
+            names = np.array([_player.name for _player in players], dtype=str)
+            for q, name in self.names:
+                met[:, q] &= np.char.find(names, name) >= 0
+
+        if not self.any_evos.all():
+            done = np.zeros((n_players, len(self.evo_idx)), dtype=np.int16)  # Player x evolution
+            for i, _player in enumerate(players):
+                for evolution in _player.evolutions:
+                    done[i, self.evo_idx[evolution.name]] = 1
+            met &= self.any_evos | ((done @ self.wanted_evos) != 0)
+
+        return met
+
+
+# Loosest conditions of many conditions sets - met by any player meeting one of them
+def loosest_cond(conds: list):
+    loose = {}
+    for key in set().union(*conds):
+        vals = [cond.get(key) for cond in conds]
+        if key.startswith('min'):
+            loose[key] = min(val or 0 for val in vals)
+        elif key in ('wanted_positions', 'wanted_playstyles'):  # Any of the wanted ones, if all the queries want
+            if all(val is not None for val in vals):
+                loose[key] = set().union(*vals)
+        elif key == 'wanted_evos':
+            if all(val is not None for val in vals):
+                loose[key] = list({evolution.name: evolution for val in vals for evolution in val}.values())
+        elif len(set(vals)) == 1:  # name, playstyle plus and work rates - the same value in all the queries
+            loose[key] = vals[0]
+
+    return loose
+
+
+# Bound of many conditions sets - a state is kept while any of the queries may still be met from it. The loosest
+# conditions are checked first, so a state out of reach of all the queries is mostly pruned by one check, and the
+# query last found reachable is checked before the others, as the states searched next are mostly its neighbours
+class _AnyBound:
+    def __init__(self, evo_list: list, conds: list):
+        self.loose = CondBound(evo_list, **loosest_cond(conds))
+        self.bounds = [CondBound(evo_list, **cond) for cond in conds]
+        self.active = bool(self.bounds) and all(bound.active for bound in self.bounds)
+        self.last = 0  # Index of the bound last found reachable
+
+    def reachable(self, _player, stats: tuple, remaining: list):
+        remaining = with_repeats(_player, remaining)  # Once for all the bounds
+        if self.loose.active and not self.loose.reachable_by(_player, stats, remaining):
+            return False
+
+        if self.bounds[self.last].reachable_by(_player, stats, remaining):
+            return True
+        for i, bound in enumerate(self.bounds):
+            if i != self.last and bound.reachable_by(_player, stats, remaining):
+                self.last = i
+                return True
+        return False
+
+
+# PathSearch of the evolved players at the end of a path that may meet any of the queries. Gets the search limits
+# of PathSearch - the queries are matched by a QueryMatrix, not by the search
+class BatchSearch(PathSearch):
+    def __init__(self, evo_list: list, conds: list, **kwargs):
+        super().__init__(evo_list, **kwargs)
+        self.bound = _AnyBound(evo_list, conds)
+
+
+# Answers many conditions sets over the players table in one search pass - returns a list of the evolved players
+# meeting each query, in conds order. Gets the search limits of PathSearch, the base players whose search was cut by
+# a limit are appended to truncated
+def batch_search(table: PlayerTable, evo_list: list, conds: list, truncated=None, **kwargs):
+    results = [[] for _ in conds]
+    if not conds:
+        return results
+
+    matrix = QueryMatrix(conds, evo_list)
+    rows = np.unique(np.concatenate([filter_players(table, evo_list, **cond) for cond in conds]))  # Any query
+    search = BatchSearch(evo_list, conds, **kwargs)
+
+    def match(players: list):
+        met = matrix.match(players)
+        for q in range(matrix.n_queries):
+            results[q].extend(players[i] for i in np.flatnonzero(met[:, q]))
+
+    found = []
+    for i in rows:
+        if search.exhausted():
+            break
+        found.extend(search.iter_paths(table.player(i)))
+        if len(found) >= CHUNK_SIZE:
+            match(found)
+            found = []
+    if found:
+        match(found)
+
+    if truncated is not None:
+        truncated.extend(search.truncated)
+    return results
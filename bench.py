@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from batch import batch_search
+from dataset import PlayerTable, load_players
+from evo import Evo, curr_evos
+from path_index import PathIndex
+from prefilter import filter_players
+from profiler import SearchProfile
+from search import PathSearch, iter_evolved_players
+
+'''
+Benchmark suite of the evolution path finder - the main.py workflow over the bundled players CSV and curr_evos, and
+over synthetic players tables and evolution lists for larger loads. Measures load time, search nodes per second,
+end to end query latency and peak memory (tracemalloc, separate run). Every run is appended to a results file with
+its git commit, and compared with the last run of another commit to catch regressions.
+'''
+
+RESULTS_PATH = 'bench_results.jsonl'
+COND = {'min_skills': 5, 'min_wf': 5}  # main.py conditions
+# Variants of the main.py conditions, as submitted together by an analyst
+BATCH_CONDS = [{'min_skills': skills, 'min_wf': wf, 'wanted_positions': {pos}} for skills in (3, 4, 5) for wf in (4, 5)
+               for pos in ('ST', 'CAM', 'CM', 'CB')]
+LOWER_IS_BETTER = ('time', 'peak_mb')  # Metrics suffixes that regress when raised - the rest regress when lowered
+
+
+# Synthetic players table - rows sampled from a real table with stats jittered by up to jitter points
+def synthetic_players(table: PlayerTable, n_players: int, seed=0, jitter=3):
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(table), n_players)
+    stats = np.asarray(table.stats, dtype=np.int16)[rows] + rng.integers(-jitter, jitter + 1, (n_players, 7))
+
+    return PlayerTable({
+        'name': np.char.add(np.asarray(table.name)[rows], np.char.mod(' #%d', np.arange(n_players))),
+        'stats': np.clip(stats, 1, 99).astype(np.int8),
+        'skills': np.asarray(table.skills)[rows],
+        'wf': np.asarray(table.wf)[rows],
+        'positions': np.asarray(table.positions)[rows],
+        'playstyle_plus': np.asarray(table.playstyle_plus)[rows],
+        'playstyles': np.asarray(table.playstyles)[rows],
+        'n_playstyles': np.asarray(table.n_playstyles)[rows],
+        'att_wr': np.asarray(table.att_wr)[rows],
+        'def_wr': np.asarray(table.def_wr)[rows]
+    })
+
+
+# Synthetic evolutions list - n_evos copies of the current evolutions under distinct names, as if the game released
+# each one again and again
+def synthetic_evos(n_evos: int):
+    distinct = curr_evos
+    return [Evo(f"{distinct[i % len(distinct)].name} #{i // len(distinct) + 1}", distinct[i % len(distinct)].price,
+                distinct[i % len(distinct)].req, distinct[i % len(distinct)].upg) for i in range(n_evos)]
+
+
+# Best time out of repeat runs of func
+def _best_time(func, repeat: int):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# Peak traced memory of one run of func, in MB
+def _peak_mb(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+# Number of search nodes (expanded states) of the base players of the rows
+def _count_nodes(table: PlayerTable, rows, evo_list: list, **kwargs):
+    profile = SearchProfile()
+    search = profile.search(evo_list, **kwargs)
+    for i in rows:
+        for _ in search.iter_paths(table.player(i)):
+            pass
+    return profile.totals()['nodes']
+
+
+# Benchmark of the main.py query - prefilter then streamed search, and of the full (no conditions) search of every
+# player, as done by a paths index build
+def _bench_search(table: PlayerTable, evo_list: list, repeat: int, full=True):
+    def query():
+        rows = filter_players(table, evo_list, **COND)
+        return sum(1 for _ in iter_evolved_players((table.player(i) for i in rows), evo_list, **COND))
+
+    def full_search():
+        search = PathSearch(evo_list)
+        return sum(1 for i in range(len(table)) for _ in search.iter_paths(table.player(i)))
+
+    result = {'players': len(table), 'evos': len(evo_list), 'found': query()}
+    result['query_time'] = _best_time(query, repeat)
+    result['query_peak_mb'] = _peak_mb(query)
+    if not full:
+        return result
+
+    result['full_paths'] = full_search()
+    result['full_time'] = _best_time(full_search, repeat)
+    result['full_nodes_per_sec'] = _count_nodes(table, range(len(table)), evo_list) / result['full_time']
+    result['full_peak_mb'] = _peak_mb(full_search)
+    return result
+
+
+def bench_load(csv_path: str, repeat: int):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        def cold():
+            return load_players(csv_path, use_cache=False)
+
+        def warm():
+            return load_players(csv_path, cache_dir=cache_dir)
+
+        load_players(csv_path, cache_dir=cache_dir)  # Writes the cache
+        return {'csv_time': _best_time(cold, repeat), 'cache_time': _best_time(warm, repeat),
+                'csv_peak_mb': _peak_mb(cold)}
+
+
+# Benchmark of many queries - answered in one batch search pass, and one by one as main.py queries
+def bench_batch(table: PlayerTable, evo_list: list, repeat: int):
+    def batch():
+        return sum(len(evolved) for evolved in batch_search(table, evo_list, BATCH_CONDS))
+
+    def sequential():
+        return sum(1 for cond in BATCH_CONDS for _ in iter_evolved_players(
+            (table.player(i) for i in filter_players(table, evo_list, **cond)), evo_list, **cond))
+
+    return {'queries': len(BATCH_CONDS), 'found': batch(), 'batch_time': _best_time(batch, repeat),
+            'sequential_time': _best_time(sequential, 1)}
+
+
+def bench_index(table: PlayerTable, evo_list: list, repeat: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index = PathIndex(os.path.join(tmp_dir, 'evo_paths.db'))
+        build_time = _best_time(lambda: index.build(table, evo_list), 1)
+
+        def query():
+            return sum(1 for _ in index.query(evo_list, **COND))
+
+        result = {'build_time': build_time, 'found': query(), 'query_time': _best_time(query, repeat)}
+        index.close()
+        return result
+
+
+CASES = {
+    'load': lambda table, csv_path, repeat: bench_load(csv_path, repeat),
+    'search': lambda table, csv_path, repeat: _bench_search(table, curr_evos, repeat),
+    'index': lambda table, csv_path, repeat: bench_index(table, curr_evos, repeat),
+    'batch': lambda table, csv_path, repeat: bench_batch(table, curr_evos, repeat),
+    # Ten times the players - the main.py query only
+    'synthetic_players': lambda table, csv_path, repeat: _bench_search(synthetic_players(table, 10 * len(table)),
+                                                                       curr_evos, repeat, full=False),
+    # 50 evolutions - paths grow combinatorially with the repeated evolutions, so a sample of players is searched
+    'synthetic_evos': lambda table, csv_path, repeat: _bench_search(synthetic_players(table, 40), synthetic_evos(50),
+                                                                    repeat)
+}
+
+
+# Current git commit, marked dirty with uncommitted changes (None - not a git checkout)
+def _git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(cases: list, csv_path='eafc_players_final.csv', repeat=3):
+    table = load_players(csv_path)
+    return {'commit': _git_commit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(), 'repeat': repeat,
+            'cases': {case: CASES[case](table, csv_path, repeat) for case in cases}}
+
+
+def load_results(path=RESULTS_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_result(result: dict, path=RESULTS_PATH):
+    with open(path, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+
+
+# Compares the metrics of two runs - returns (case, metric, old, new, change) of the metrics worse by over threshold
+def regressions(old: dict, new: dict, threshold=0.1):
+    worse = []
+    for case, metrics in new['cases'].items():
+        for metric, new_val in metrics.items():
+            old_val = old['cases'].get(case, {}).get(metric)
+            if not isinstance(new_val, float) or not old_val:
+                continue
+            change = new_val / old_val - 1
+            if (change if metric.endswith(LOWER_IS_BETTER) else -change) > threshold:
+                worse.append((case, metric, old_val, new_val, change))
+    return worse
+
+
+def format_result(result: dict):
+    lines = [f"commit {result['commit']}, {result['date']}, python {result['python']}, best of {result['repeat']}"]
+    for case, metrics in result['cases'].items():
+        lines.append(f"  {case}: " + ', '.join(f"{metric} {val:.4g}" if isinstance(val, float) else f"{metric} {val}"
+                                              for metric, val in metrics.items()))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the evolution path finder")
+    parser.add_argument('cases', nargs='*', metavar='CASE', help=f"cases to run: {', '.join(CASES)} (default - all)")
+    parser.add_argument('--repeat', type=int, default=3, help="timing runs per measure, the best one is kept")
+    parser.add_argument('--results', default=RESULTS_PATH, help="results file the run is appended to")
+    parser.add_argument('--compare', nargs='?', const='', metavar='COMMIT',
+                        help="compare with the last run of COMMIT (default - of the last other commit)")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative change reported as a regression")
+    args = parser.parse_args()
+    if set(args.cases) - set(CASES):
+        parser.error(f"unknown cases: {', '.join(sorted(set(args.cases) - set(CASES)))}")
+
+    result = run(args.cases or list(CASES), repeat=args.repeat)
+    print(format_result(result))
+    previous = load_results(args.results)
+    save_result(result, args.results)
+
+    if args.compare is not None:
+        base = [old for old in previous if old['commit'] != result['commit'] and
+                (old['commit'] or '').startswith(args.compare)]
+        if not base:
+            print("No run to compare with")
+        else:
+            print(f"\nCompared with commit {base[-1]['commit']} ({base[-1]['date']}):")
+            worse = regressions(base[-1], result, args.threshold)
+            for case, metric, old_val, new_val, change in worse:
+                print(f"  REGRESSION {case}.{metric}: {old_val:.4g} -> {new_val:.4g} ({change:+.0%})")
+            if not worse:
+                print("  No regressions")
+            raise SystemExit(1 if worse else 0)
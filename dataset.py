@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import numpy as np
+from player import Player
+from utils import STATS, VOCABULARY_HASH, to_positions_mask, to_playstyles_mask, to_set, get_rarity
+
+'''
+Columnar players database - the players CSV is parsed once into typed columns (int8 stats and stars, positions
+and playstyles bitmasks) and kept in a binary cache of .npy files next to it. The cache is memory-mapped on load and
+rebuilt when the CSV changes (size or modification time) or the positions and playstyles bits change.
+'''
+
+CACHE_VERSION = 1  # Bump when the cache layout changes
+COLUMNS = ('name', 'stats', 'skills', 'wf', 'positions', 'playstyle_plus', 'playstyles', 'n_playstyles', 'att_wr',
+           'def_wr')
+
+
+class PlayerTable:
+    def __init__(self, columns: dict):
+        self.name = columns['name']
+        self.stats = columns['stats']  # Rows of stats in STATS order
+        self.skills = columns['skills']
+        self.wf = columns['wf']
+        self.positions = columns['positions']  # Positions bitmasks
+        self.playstyle_plus = columns['playstyle_plus']
+        self.playstyles = columns['playstyles']  # PlayStyles bitmasks
+        self.n_playstyles = columns['n_playstyles']
+        self.att_wr = columns['att_wr']
+        self.def_wr = columns['def_wr']
+
+    def __len__(self):
+        return len(self.name)
+
+    # Hash of all the columns - equal for equal tables, whatever file they were loaded from
+    def fingerprint(self):
+        digest = hashlib.sha1()
+        for col in COLUMNS:
+            values = np.ascontiguousarray(getattr(self, col))
+            digest.update(f"{col}:{values.dtype.str}:{values.shape}".encode())
+            digest.update(values.tobytes())
+        return digest.hexdigest()
+
+    # Builds the table out of the players DataFrame (eafc_players_final.csv columns)
+    @classmethod
+    def from_frame(cls, df):
+        df = df.fillna('None')  # Players with no PlaystylePlus
+        pos_masks = {pos: to_positions_mask(pos) for pos in df['positions'].unique()}
+        ps_masks = {ps: to_playstyles_mask(ps) for ps in df['playstyles'].unique()}
+        df = df.assign(positions=df['positions'].map(pos_masks), playstyles=df['playstyles'].map(ps_masks),
+                       n_playstyles=df['playstyles'].map({ps: len(to_set(ps)) for ps in ps_masks}))
+        df = df.drop_duplicates()  # Players scraped twice - positions and playstyles may be in any order
+
+        return cls({
+            'name': df['name'].to_numpy(dtype=str),
+            'stats': df[list(STATS)].to_numpy(dtype=np.int8),
+            'skills': df['skills'].to_numpy(dtype=np.int8),
+            'wf': df['wf'].to_numpy(dtype=np.int8),
+            'positions': df['positions'].to_numpy(dtype=np.int32),
+            'playstyle_plus': df['playstyle_plus'].to_numpy(dtype=str),
+            'playstyles': df['playstyles'].to_numpy(dtype=np.int64),
+            'n_playstyles': df['n_playstyles'].to_numpy(dtype=np.int8),
+            'att_wr': df['att_wr'].to_numpy(dtype=str),
+            'def_wr': df['def_wr'].to_numpy(dtype=str)
+        })
+
+    # Creates the base player of row i
+    def player(self, i: int):
+        _ovr, _pac, _sho, _pas, _dri, _def, _phy = self.stats[i].tolist()
+        return Player(str(self.name[i]), _pac, _sho, _pas, _dri, _def, _phy, _ovr, int(self.skills[i]),
+                      int(self.wf[i]), int(self.positions[i]), str(self.playstyle_plus[i]),
+                      int(self.playstyles[i]), str(self.att_wr[i]), str(self.def_wr[i]),
+                      get_rarity(_ovr), list())
+
+    # Creates the base players of the rows in indices (all the rows if None)
+    def players(self, indices=None):
+        if indices is None:
+            indices = range(len(self))
+        return [self.player(i) for i in indices]
+
+    # Saves the columns as .npy files in cache_dir. Metadata is written last, so a partial cache is never valid
+    def save(self, cache_dir: str, meta: dict):
+        os.makedirs(cache_dir, exist_ok=True)
+        meta_path = os.path.join(cache_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        for col in COLUMNS:
+            np.save(os.path.join(cache_dir, f"{col}.npy"), getattr(self, col))
+
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+
+    # Loads the columns of a cache_dir memory-mapped - returns None if the cache is missing or not for meta
+    @classmethod
+    def load(cls, cache_dir: str, meta: dict):
+        try:
+            with open(os.path.join(cache_dir, 'meta.json')) as f:
+                if json.load(f) != meta:  # Cache of another CSV version
+                    return None
+            return cls({col: np.load(os.path.join(cache_dir, f"{col}.npy"), mmap_mode='r') for col in COLUMNS})
+        except (OSError, ValueError):
+            return None
+
+
+# Parses the players CSV into a table - pandas is imported only here, it is not needed to load a valid cache
+def _read_csv(csv_path: str):
+    import pandas as pd
+    return PlayerTable.from_frame(pd.read_csv(csv_path))
+
+
+# Metadata identifying the CSV version and the bitmasks vocabulary a cache was built with
+def _csv_meta(csv_path: str):
+    stat = os.stat(csv_path)
+    return {'version': CACHE_VERSION, 'csv_size': stat.st_size, 'csv_mtime_ns': stat.st_mtime_ns,
+            'vocabulary': VOCABULARY_HASH}
+
+
+# Loads the players table of a CSV - from its binary cache if valid, otherwise the CSV is parsed and cached.
+# cache_dir - defaults to a ".cache" directory next to the CSV, None with use_cache=False skips the cache
+def load_players(csv_path='eafc_players_final.csv', cache_dir=None, use_cache=True):
+    if not use_cache:
+        return _read_csv(csv_path)
+
+    if cache_dir is None:
+        cache_dir = os.path.splitext(csv_path)[0] + '.cache'
+
+    meta = _csv_meta(csv_path)
+    table = PlayerTable.load(cache_dir, meta)
+    if table is None:  # Missing or stale cache
+        table = _read_csv(csv_path)
+        table.save(cache_dir, meta)
+
+    return table
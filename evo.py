@@ -1,12 +1,117 @@
-from copy import deepcopy
+import json
+import os
+import sys
+from datetime import date
+from functools import lru_cache
+from operator import le
+from utils import STATS, MAX_STAT, POSITIONS, PLAYSTYLES, WORK_RATES, positions_mask, playstyles_mask
+
+
+# Evolution requirements compiled once - checking a player is a handful of integer comparisons
+class ReqCheck:
+    __slots__ = ('evo_name', 'repeat', 'last_use', 'min_stats', 'max_stats', 'positions', 'no_positions',
+                 'max_playstyles', 'no_playstyle_plus', 'rarity')
+
+    # last_use - the bit of the players used evolutions mask set by the last time the evolution may be done
+    def __init__(self, evo_name: str, req: dict, repeat=1, last_use=0):
+        self.evo_name = evo_name
+        self.repeat = repeat  # Times a player may do the evolution
+        self.last_use = last_use
+        self.min_stats = tuple(req.get(f"min{stat}", 0) for stat in STATS)  # Bound vectors in STATS order
+        self.max_stats = tuple(req.get(f"max{stat}", MAX_STAT) for stat in STATS)
+        self.positions = positions_mask(frozenset(req['positions'])) if 'positions' in req else 0  # 0 - any
+        self.no_positions = positions_mask(frozenset(req.get('no_positions', ())))
+        self.max_playstyles = req.get('max_playstyles')  # None - no limit
+        self.no_playstyle_plus = 'playstyle_plus' in req  # Player must not have a playstyle plus yet
+        self.rarity = req.get('rarity')  # None - any rarity
+
+        for key in req:  # Min/max requirements are supported on stats only
+            if key.startswith(("min", "max")) and key != "max_playstyles" and key[3:] not in STATS:
+                raise ValueError(f"Unsupported requirement '{key}' in evolution {evo_name}")
+
+    # Checks if the player, and so any player evolved from him, can never fit the requirements.
+    # Evolutions only raise stats and only add positions, playstyles and playstyle plus
+    def blocked(self, _player, stats: tuple, pos_mask: int):
+        if _player.used & self.last_use:  # Evolution has been used as many times as it may be
+            return True
+
+        if self.no_playstyle_plus and _player.playstyle_plus != "None":  # Check playstyle plus violation
+            return True
+
+        if self.max_playstyles is not None and self.max_playstyles < _player.playstyles.bit_count():  # Too many
+            return True
+
+        if self.no_positions & pos_mask:  # Position not allowed
+            return True
+
+        return not all(map(le, stats, self.max_stats))
+
+    # Checks the requirements that may still be met later by evolving (min stats, positions and rarity)
+    def ready(self, _player, stats: tuple, pos_mask: int):
+        if self.positions and not self.positions & pos_mask:  # No fitting position
+            return False
+
+        if self.rarity is not None and self.rarity != _player.rarity:  # Not the desired rarity
+            return False
+
+        return all(map(le, self.min_stats, stats))
+
+    # Checks the requirements over a player, his stat vector and his positions mask
+    def fits(self, _player, stats: tuple, pos_mask: int):
+        return not self.blocked(_player, stats, pos_mask) and self.ready(_player, stats, pos_mask)
+
+    # Returns the key of the first requirement the player fails ('used' - evolution has been used), None if he fits.
+    # Slower than fits - for search cost reports only
+    def failed(self, _player, stats: tuple, pos_mask: int):
+        if _player.used & self.last_use:
+            return 'used'
+        if self.no_playstyle_plus and _player.playstyle_plus != "None":
+            return 'playstyle_plus'
+        if self.max_playstyles is not None and self.max_playstyles < _player.playstyles.bit_count():
+            return 'max_playstyles'
+        if self.no_positions & pos_mask:
+            return 'no_positions'
+        for stat, stat_val, max_stat in zip(STATS, stats, self.max_stats):
+            if stat_val > max_stat:
+                return f"max{stat}"
+        if self.positions and not self.positions & pos_mask:
+            return 'positions'
+        if self.rarity is not None and self.rarity != _player.rarity:
+            return 'rarity'
+        for stat, stat_val, min_stat in zip(STATS, stats, self.min_stats):
+            if stat_val < min_stat:
+                return f"min{stat}"
+
+        return None
+
+
+# Bits of the players used evolutions masks - each evolution (by name and repeat count) gets repeat bits of its own,
+# set one after the other each time a player does it
+_USE_SHIFTS = {}
+
+
+# First bit of an evolution in the used evolutions masks
+def _use_shift(name: str, repeat: int):
+    if (name, repeat) not in _USE_SHIFTS:
+        _USE_SHIFTS[(name, repeat)] = sum(key[1] for key in _USE_SHIFTS)  # Next free bit
+    return _USE_SHIFTS[(name, repeat)]
 
 
 class Evo:
-    def __init__(self, name, price, req, upg):
+    # repeat - times a player may do the evolution, a stackable evolution is one Evo done up to repeat times
+    def __init__(self, name, price, req, upg, repeat=1):
         self.name = name
         self.price = price
         self.req = req
         self.upg = upg
+        self.repeat = repeat
+        shift = _use_shift(name, repeat)
+        self.first_use = 1 << shift  # Bits of the evolution in the players used evolutions masks
+        self.uses = ((1 << repeat) - 1) << shift
+        self.req_check = ReqCheck(name, req, repeat, 1 << (shift + repeat - 1))  # Compiled once for the hot path
+        self.upg_stats = tuple(upg.get(stat, 0) for stat in STATS)  # Stats upgrades vector in STATS order
+        self.upg_positions = positions_mask(frozenset(upg.get('positions', ())))  # Upgrades bitmasks
+        self.upg_playstyles = playstyles_mask(frozenset(upg.get('playstyles', ())))
 
     def __str__(self):
         return self.name
@@ -22,54 +127,21 @@ class Evo:
     def __eq__(self, other):
         return isinstance(other, Evo) and self.name == other.name
 
-    # Gets a player object and checks requirements for evolution
-    def is_evo_able(self, _player):
-        for done_evo in getattr(_player, "evolutions"):  # Iterate over already done evolutions of the player
-            if self.name == getattr(done_evo, "name"):  # Evo has been used
-                return False
-
-        for key in self.req:
-            req_val = self.req[key]
-
-            if key == "playstyle_plus" and getattr(_player, key) != "None":  # Check playstyle plus violation
-                return False
-
-            if key == "max_playstyles" and req_val < len(getattr(_player, "playstyles")):  # Too many playstyles
-                return False
-
-            if key == "positions":  # Check if position fits
-                hit = False
-                for pos in req_val:
-                    if pos in getattr(_player, key):  # Position fits
-                        hit = True
-                        break
-                if not hit:
-                    return False
-
-            if key == "rarity":  # Check if desired rarity
-                if req_val != getattr(_player, "rarity"):
-                    return False
-
-            if key == "no_positions":  # Position not allowed
-                for no_pos in req_val:
-                    if no_pos in getattr(_player, "positions"):
-                        return False
-
-            if "min" in key:  # Req is min rating
-                p_val = getattr(_player, key.removeprefix("min"))  # Get the relevant player stat value
-                if p_val < req_val:
-                    return False
+    # Times the player may still do the evolution
+    def times_left(self, _player):
+        return self.repeat - (_player.used & self.uses).bit_count()
 
-            if "max" in key and "playstyles" not in key:  # Req is max stat
-                p_val = getattr(_player, key.removeprefix("max"))  # Get the relevant player stat value
-                if p_val > req_val:
-                    return False
+    # Used evolutions mask after doing the evolution once more - the evolution bits are set from the lowest up
+    def add_use(self, used: int):
+        return used + (used & self.uses) + self.first_use
 
-        return True
+    # Gets a player object and checks requirements for evolution
+    def is_evo_able(self, _player):
+        return self.req_check.fits(_player, _player.stat_vector(), _player.positions)
 
     # Perform an evolution on a player object - returns a new evolved player. No requirements check
     def evolve(self, old_player):
-        evo_player = deepcopy(old_player)  # No memory shared
+        evo_player = old_player.copy()  # Player fields are immutable - a shallow copy shares no mutable memory
 
         for key in self.upg:
             upg_val = self.upg[key]
@@ -77,9 +149,9 @@ class Evo:
             if key.startswith("_"):  # Stat
                 evo_player.add_stat(key, upg_val)
             elif key == "positions":
-                evo_player.add_positions(upg_val)
+                evo_player.add_positions(self.upg_positions)
             elif key == "playstyles":
-                evo_player.add_playstyles(upg_val)
+                evo_player.add_playstyles(self.upg_playstyles)
             elif key == "playstyle_plus":
                 evo_player.add_playstyle_plus(upg_val)
             elif key == "rarity":
@@ -95,58 +167,105 @@ class Evo:
 
 
 '''
-current evolutions in game
-'''
-
-peps_legacy_req = {'max_pac': 90, 'max_dri': 86, 'max_phy': 81, 'positions': {'LB'}, 'max_playstyles': 8,
-                   'playstyle_plus': 'None'}
-peps_legacy_upg = {'wf': 2, 'skills': 1, 'playstyles': {'TIKI TAKA', 'INCISIVE PASS'}, '_ovr': 5, '_pac': 1, '_sho': 4,
-                   '_pas': 8, '_dri': 5, '_def': 2, '_phy': 2, 'rarity': 'Winter Wildcards Evo'}
-peps_legacy_evo = Evo("Pep's Legacy", 75000, peps_legacy_req, peps_legacy_upg)
-
-grow_spurt_req = {'max_ovr': 75, 'max_pac': 76, 'max_dri': 80, 'max_phy': 80, 'max_playstyles': 7,
-                  'playstyle_plus': 'None'}
-grow_spurt_upg = {'playstyles': {'TECHNICAL', 'INCISIVE PASS'}, '_ovr': 13, '_pac': 10, '_sho': 10, '_pas': 12,
-                  '_dri': 11, '_def': 11, '_phy': 9, 'playstyle_plus': 'DEAD BALL', 'rarity': 'Winter Wildcards Evo'}
-grow_spurt_evo = Evo("Growth Spurt", 0, grow_spurt_req, grow_spurt_upg)
-
-pitch_req = {'max_ovr': 85, 'max_pac': 84, 'max_pas': 81, 'max_dri': 85, 'max_phy': 82, 'positions': {'CDM'},
-             'playstyle_plus': 'None'}
-pitch_upg = {'wf': 1, 'playstyle_plus': 'INTERCEPT', '_ovr': 3, '_pac': 3, '_pas': 4, '_dri': 3, '_def': 4, '_phy': 4,
-             'rarity': 'Evolutions III'}
-pitch_one_evo = Evo('Pitch Commander 1', 150000, pitch_req, pitch_upg)
-pitch_two_evo = Evo('Pitch Commander 2', 150000, pitch_req, pitch_upg)
-
-treq_req = {'max_pac': 90, 'max_sho': 86, 'max_pas': 78, 'max_dri': 84, 'positions': {'ST'}, 'max_playstyles': 8,
-            'playstyle_plus': 'None'}
-treq_upg = {'playstyles': {'PINGED PASS'}, 'playstyle_plus': 'TIKI TAKA', '_ovr': 3, '_pac': 2, '_pas': 11, '_dri': 3,
-            '_phy': 3, 'rarity': 'Evolutions III'}
-treq_evo = Evo('Trequartista Time', 75000, treq_req, treq_upg)
-
-mid_dyn_req = {'max_ovr': 85, 'max_pac': 89, 'max_dri': 86, 'max_phy': 85, 'positions': {'LM'}, 'no_positions': {'CM'},
-               'max_playstyles': 8}
-mid_dyn_upg = {'playstyles': {'PRESS PROVEN', 'WHIPPED PASS'}, '_ovr': 3, '_pac': 3, '_sho': 4, '_pas': 4, '_dri': 3,
-               '_def': 2, '_phy': 2, 'rarity': 'Evolutions II'}
-mid_dyn_evo = Evo('Midfield Dynasty', 0, mid_dyn_req, mid_dyn_upg)
-
-dri_sen_req = {'max_ovr': 84, 'max_pac': 84, 'min_sho': 71, 'max_dri': 83, 'max_phy': 84, 'max_playstyles': 9}
-dri_sen_upg = {'playstyles': {'PRESS PROVEN'}, '_ovr': 2, '_pac': 2, '_sho': 2, '_pas': 2, '_dri': 4,
-               '_def': 2, '_phy': 2, 'rarity': 'Evolutions II'}
-dri_sen_evo = Evo('Dribbling Sensation', 0, dri_sen_req, dri_sen_upg)
-
-budding_req = {'max_ovr': 77, 'max_pac': 91, 'max_sho': 80, 'max_dri': 83, 'max_phy': 69, 'no_positions': {'CF'},
-               'max_playstyles': 8}
-budding_upg = {'playstyles': {'ACROBATIC', 'QUICK STEP'}, '_ovr': 8, '_pac': 3, '_sho': 10, '_pas': 11, '_dri': 8,
-               '_def': 5, '_phy': 9, 'rarity': 'Evolutions II'}
-budding_one_evo = Evo('Budding Starlet 1', 0, budding_req, budding_upg)
-budding_two_evo = Evo('Budding Starlet 2', 0, budding_req, budding_upg)
-
-curr_evos = [budding_one_evo, budding_two_evo, treq_evo, pitch_one_evo, pitch_two_evo,
-             dri_sen_evo, mid_dyn_evo, peps_legacy_evo, grow_spurt_evo]
-
-'''
-evolutions section end
+Evolutions catalog - the evolutions in the game are declared in evos.json, each one with its requirements,
+upgrades, price, repeat count (stackable evolutions, default 1) and optional active dates window (ISO dates,
+inclusive). The catalog is validated and compiled once - names are interned and sets are frozen, shared by all
+the players evolved - and reloaded only when the file changes.
 '''
 
-
-
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'evos.json')
+EVO_FIELDS = ('name', 'price', 'repeat', 'active_from', 'active_to', 'req', 'upg')
+REQ_KEYS = (tuple(f"min{stat}" for stat in STATS) + tuple(f"max{stat}" for stat in STATS) +
+            ('positions', 'no_positions', 'max_playstyles', 'playstyle_plus', 'rarity'))
+UPG_KEYS = STATS + ('skills', 'wf', 'positions', 'playstyles', 'playstyle_plus', 'rarity', 'att_wr', 'def_wr')
+NAMES_KEYS = {'positions': POSITIONS, 'no_positions': POSITIONS, 'playstyles': PLAYSTYLES}  # Lists of known names
+STR_KEYS = ('rarity', 'playstyle_plus', 'att_wr', 'def_wr')  # String values - the other keys are integers
+UPG_VALUES = {'playstyle_plus': PLAYSTYLES, 'att_wr': WORK_RATES, 'def_wr': WORK_RATES}  # Known upgrade values
+
+
+# Validates a requirements or upgrades dict of the catalog - returns it compiled (name lists as frozensets)
+def _compile_dict(evo_name: str, field: str, entries: dict, keys: tuple):
+    if not isinstance(entries, dict):
+        raise ValueError(f"Evolution {evo_name}: {field} must be an object")
+
+    compiled = {}
+    for key, val in entries.items():
+        if key not in keys:
+            raise ValueError(f"Evolution {evo_name}: unsupported {field} key '{key}'")
+        if key in NAMES_KEYS:
+            if (not isinstance(val, list) or not all(isinstance(name, str) for name in val)
+                    or not set(val) <= set(NAMES_KEYS[key])):
+                raise ValueError(f"Evolution {evo_name}: {field} {key} must be a list of {key} names")
+            if field == 'req' and key == 'positions' and not val:  # No positions requirement is "any", not "none"
+                raise ValueError(f"Evolution {evo_name}: req positions must not be empty - omit it for any position")
+            val = frozenset(sys.intern(name) for name in val)
+        elif key in STR_KEYS:
+            if not isinstance(val, str) or not val:
+                raise ValueError(f"Evolution {evo_name}: {field} {key} must be a string")
+            val = sys.intern(val)
+        elif not isinstance(val, int) or isinstance(val, bool) or val < 0:  # Upgrades only raise - see prefilter
+            raise ValueError(f"Evolution {evo_name}: {field} {key} must be a non negative integer")
+        compiled[key] = val
+
+    if field == 'req' and compiled.get('playstyle_plus', "None") != "None":
+        raise ValueError(f"Evolution {evo_name}: the playstyle_plus requirement can only be \"None\"")
+    if field == 'upg':
+        for key, known in UPG_VALUES.items():
+            if key in compiled and compiled[key] not in known:
+                raise ValueError(f"Evolution {evo_name}: upg {key} '{compiled[key]}' is not a known {key} value")
+    return compiled
+
+
+# Validates a catalog entry - returns its Evo and active dates window (None - open)
+def _compile_evo(entry: dict):
+    if not isinstance(entry, dict):
+        raise ValueError(f"Evolution entries must be objects: {entry}")
+    evo_name = entry.get('name')
+    if not isinstance(evo_name, str) or not evo_name:
+        raise ValueError(f"Evolution with no name: {entry}")
+    unknown = set(entry) - set(EVO_FIELDS)
+    if unknown:
+        raise ValueError(f"Evolution {evo_name}: unknown fields {', '.join(sorted(unknown))}")
+
+    price = entry.get('price', 0)
+    repeat = entry.get('repeat', 1)
+    for field, val, min_val in (('price', price, 0), ('repeat', repeat, 1)):
+        if not isinstance(val, int) or isinstance(val, bool) or val < min_val:
+            raise ValueError(f"Evolution {evo_name}: {field} must be an integer of at least {min_val}")
+
+    try:
+        active = tuple(None if entry.get(field) is None else date.fromisoformat(entry[field])
+                       for field in ('active_from', 'active_to'))
+    except (TypeError, ValueError):
+        raise ValueError(f"Evolution {evo_name}: active dates must be ISO dates (YYYY-MM-DD)") from None
+    if None not in active and active[0] > active[1]:
+        raise ValueError(f"Evolution {evo_name}: active_from {active[0]} is after active_to {active[1]}")
+
+    req = _compile_dict(evo_name, 'req', entry.get('req', {}), REQ_KEYS)
+    upg = _compile_dict(evo_name, 'upg', entry.get('upg', {}), UPG_KEYS)
+    return Evo(sys.intern(evo_name), price, req, upg, repeat), active
+
+
+# Compiled catalog of a file version - cached, so a catalog is parsed once per process
+@lru_cache(maxsize=8)
+def _load_catalog(path: str, mtime_ns: int):
+    with open(path) as f:
+        catalog = json.load(f)
+    if not isinstance(catalog, dict) or not isinstance(catalog.get('evos', []), list):
+        raise ValueError(f"{path} must be an object with a list of evolutions in 'evos'")
+
+    compiled = [_compile_evo(entry) for entry in catalog.get('evos', ())]
+    names = [evolution.name for evolution, _ in compiled]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate evolution names in {path} - use repeat for a stackable evolution")
+    return tuple(compiled)
+
+
+# Returns the evolutions of a catalog file active on a date (default today), in catalog order
+def load_evos(path=CATALOG_PATH, on_date=None):
+    on_date = date.today() if on_date is None else on_date
+    return [evolution for evolution, (active_from, active_to) in _load_catalog(path, os.stat(path).st_mtime_ns)
+            if (active_from is None or active_from <= on_date) and (active_to is None or on_date <= active_to)]
+
+
+curr_evos = load_evos()  # Current evolutions in the game
@@ -1,29 +1,65 @@
-import pandas as pd
-from player import Player
-from utils import to_set, get_rarity
+from dataset import load_players
 from evo import curr_evos  # List of current evolutions in the game
+from prefilter import filter_players
+from reverse import reverse_search
+from parallel import search_parallel
+from search import iter_evolved_players
+from path_index import PathIndex
 
 if __name__ == '__main__':
-    # Import DataFrame
-    df = pd.read_csv('eafc_players_final.csv')
-    df.fillna('None', inplace=True)  # Fix nan in df (mostly for PlaystylePlus)
-
-    player_set = set()  # Init set of evolved players
+    # Import players table - parsed once and loaded from its binary cache on later runs
+    table = load_players('eafc_players_final.csv')
 
     # Choose evolutions for player search
     # evo_list = [evolution for evolution in curr_evos if evolution.name == 'Midfield Dynasty']
     evo_list = curr_evos  # In case all evolutions are wanted to search in
 
-    # Run over df rows, each row create player and check evo_paths
-    for i in range(df.shape[0]):
-        row = df.iloc[i].tolist()  # Convert row to list
-        player = Player(row[0], row[1], row[2], row[3], row[4], row[5], row[6],  # Create player object
-                        row[7], row[8], row[9], to_set(row[10]), row[11], to_set(row[12]),
-                        row[13], row[14], get_rarity(row[7]), list())
+    cond = {'min_skills': 5, 'min_wf': 5}  # Specify conditions (see Player.eval_cond)
+
+    # Search limits of each player (see PathSearch) - max_time (seconds), max_nodes, max_depth. Players cut by a
+    # limit are reported with partial results
+    limits = {}  # e.g. {'max_time': 1.0, 'max_depth': 6}
+
+    # Find the evolved players on the way too, not only at the path ends - e.g. a player meeting the conditions after
+    # his first evolution, with no need to pay for the next ones. limits['max_depth'] is then a cap of the paths
+    prefixes = False
+
+    # Optimal paths - 'cost' for the cheapest paths, a stat ('_ovr') or stats weights ({'_pac': 2, '_dri': 1}) for the
+    # highest. Only the top_k best evolved players of each player are searched for (see OptimalPathSearch)
+    optimize = None
+    top_k = 1
+
+    workers = 1  # Number of processes for the search - more than 1 shards the players across a process pool
+
+    index_path = None  # Prebuilt paths index of evo_list (python path_index.py) - queried instead of searching.
+    # The index holds the path ends only, so it is not used for prefixes
+
+    reverse = False  # Pick the players to search by a reverse search from the conditions (see reverse.py)
+
+    if reverse:  # Only the players that can reach the conditions are searched
+        indices, _ = reverse_search(table, evo_list, **cond)
+    else:  # Drop players that can't end as a wanted evolved player before searching their paths
+        indices = filter_players(table, evo_list, **cond)
 
-        player.update_evo_paths(player_set, evo_list, min_skills=5, min_wf=5)  # Specify conditions
+    truncated = []  # Base players whose search was cut by a limit
+    if optimize is not None:  # Best-first search, stops once the best players are proven
+        evolved_players = iter_evolved_players((table.player(i) for i in indices), evo_list, truncated=truncated,
+                                               objective=optimize, top_k=top_k, prefixes=prefixes, **limits, **cond)
+    elif index_path is not None and not prefixes:
+        evolved_players = PathIndex(index_path).query(evo_list, **cond)
+    elif workers > 1:
+        evolved_players = search_parallel(table.players(indices), evo_list, workers=workers, chunk_size=64,
+                                          truncated=truncated, prefixes=prefixes, **limits, **cond)
+    else:
+        # Run over table rows, each row create player and stream his evolved players as soon as they are found
+        evolved_players = iter_evolved_players((table.player(i) for i in indices), evo_list, truncated=truncated,
+                                               prefixes=prefixes, **limits, **cond)
 
-    for p in player_set:
+    found = 0
+    for p in evolved_players:
         print(p)
-    print(f"The number of players found: {len(player_set)}")
+        found += 1
+    print(f"The number of players found: {found}")
+    if truncated:
+        print(f"Search cut by a limit for {len(truncated)} players: {', '.join(p.name for p in truncated)}")
 
@@ -0,0 +1,41 @@
+from concurrent.futures import ProcessPoolExecutor
+
+# Parallel evolution path search - the base players are sharded across a pool of worker processes
+
+_evo_list = None  # Search settings of a worker process, set once by _init_worker
+_cond = None
+
+
+# Initializes a worker process with the evolutions and conditions of the search
+def _init_worker(evo_list: list, cond: dict):
+    global _evo_list, _cond
+    _evo_list = evo_list
+    _cond = cond
+
+
+# Searches the evo paths of a chunk of base players in a worker process - returns the evolved players found and
+# the base players whose search was cut by a limit
+def _search_chunk(base_players: list):
+    player_set = set()
+    truncated = [base_player for base_player in base_players
+                 if not base_player.update_evo_paths(player_set, _evo_list, **_cond)]
+
+    return player_set, truncated
+
+
+# Searches the evo paths of all the base players in parallel.
+# Gets the conditions of Player.eval_cond and the per player limits of PathSearch (a global budget can't be shared
+# across processes), and returns one set of all the evolved players found.
+# workers - number of processes (None - cpu count), chunk_size - number of players sent to a worker at once.
+# truncated - a list the base players whose search was cut by a limit are added to
+def search_parallel(base_players: list, evo_list: list, workers=None, chunk_size=64, truncated=None, **kwargs):
+    player_set = set()
+    chunks = [base_players[i:i + chunk_size] for i in range(0, len(base_players), chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(evo_list, kwargs)) as pool:
+        for found, cut in pool.map(_search_chunk, chunks):
+            player_set.update(found)  # Merged into one set - duplicates are dropped
+            if truncated is not None:
+                truncated.extend(cut)
+
+    return player_set
@@ -0,0 +1,186 @@
+import json
+import sqlite3
+from dataset import PlayerTable, load_players
+from player import Player
+from search import PathSearch
+from prefilter import rows_may_use
+from utils import STATS, VOCABULARY_HASH, positions_mask, playstyles_mask
+
+'''
+Precomputed evolution paths index - every evolved player at the end of a path, reachable from the players table
+with an evolutions list, is enumerated once and stored in an indexed SQLite table. Queries with the conditions of
+Player.eval_cond are then index lookups and range filters, with no path search.
+When evolutions are added to or removed from the list, only the base players they may affect are searched again.
+'''
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS evolved (
+    base_id INTEGER NOT NULL,  -- Row of the base player in the players table
+    name TEXT NOT NULL,
+    _ovr INTEGER NOT NULL, _pac INTEGER NOT NULL, _sho INTEGER NOT NULL, _pas INTEGER NOT NULL,
+    _dri INTEGER NOT NULL, _def INTEGER NOT NULL, _phy INTEGER NOT NULL,
+    skills INTEGER NOT NULL, wf INTEGER NOT NULL,
+    positions INTEGER NOT NULL,  -- Positions bitmask
+    playstyle_plus TEXT NOT NULL,
+    playstyles INTEGER NOT NULL,  -- PlayStyles bitmask
+    att_wr TEXT NOT NULL, def_wr TEXT NOT NULL, rarity TEXT NOT NULL,
+    evolutions TEXT NOT NULL  -- Evolution names in path order, as |name|name|
+);
+CREATE INDEX IF NOT EXISTS evolved_base ON evolved (base_id);
+CREATE INDEX IF NOT EXISTS evolved_ovr ON evolved (_ovr);
+CREATE INDEX IF NOT EXISTS evolved_pac ON evolved (_pac);
+CREATE INDEX IF NOT EXISTS evolved_sho ON evolved (_sho);
+CREATE INDEX IF NOT EXISTS evolved_pas ON evolved (_pas);
+CREATE INDEX IF NOT EXISTS evolved_dri ON evolved (_dri);
+CREATE INDEX IF NOT EXISTS evolved_def ON evolved (_def);
+CREATE INDEX IF NOT EXISTS evolved_phy ON evolved (_phy);
+CREATE INDEX IF NOT EXISTS evolved_stars ON evolved (skills, wf);
+CREATE INDEX IF NOT EXISTS evolved_playstyle_plus ON evolved (playstyle_plus);
+'''
+COLUMNS = ('base_id', 'name') + STATS + ('skills', 'wf', 'positions', 'playstyle_plus', 'playstyles', 'att_wr',
+                                         'def_wr', 'rarity', 'evolutions')
+INSERT = f"INSERT INTO evolved ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+
+
+# Fingerprint of an evolution definition - an evolution changed under the same name is updated as removed and added
+def _evo_fingerprint(evolution):
+    return json.dumps([evolution.req, evolution.upg, evolution.repeat], sort_keys=True, default=sorted)
+
+
+# Index row of an evolved player
+def _to_row(base_id: int, evo_player: Player):
+    path = ''.join(f"|{evolution.name}" for evolution in evo_player.evolutions) + '|'
+    return ((base_id, evo_player.name) + evo_player.stat_vector() +
+            (evo_player.skills, evo_player.wf, evo_player.positions, evo_player.playstyle_plus,
+             evo_player.playstyles, evo_player.att_wr, evo_player.def_wr, evo_player.rarity, path))
+
+
+class PathIndex:
+    def __init__(self, db_path='evo_paths.db'):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # Value of a metadata key (None - not built)
+    def _meta(self, key: str):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def _set_meta(self, table: PlayerTable, evo_list: list):
+        self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", (
+            ('evos', json.dumps({evolution.name: _evo_fingerprint(evolution) for evolution in evo_list})),
+            ('table', json.dumps(table.fingerprint())),
+            ('vocabulary', json.dumps(VOCABULARY_HASH))))
+
+    # Names of the evolutions the index was built with (None - not built)
+    def evo_names(self):
+        evos = self._meta('evos')
+        return list(evos) if evos is not None else None
+
+    # Inserts the evolved players at the end of every path of the base players in rows of the table
+    def _insert_paths(self, table: PlayerTable, evo_list: list, rows):
+        search = PathSearch(evo_list)  # No conditions - every path end is stored
+        self.conn.executemany(INSERT, (_to_row(base_id, evo_player)
+                                       for base_id in rows
+                                       for evo_player in search.iter_paths(table.player(base_id))
+                                       if evo_player.evolutions))
+
+    # Enumerates every path of every player in the table with the evolutions list and stores it, replacing the index
+    def build(self, table: PlayerTable, evo_list: list):
+        with self.conn:  # One transaction
+            self.conn.execute("DELETE FROM evolved")
+            self._insert_paths(table, evo_list, range(len(table)))
+            self._set_meta(table, evo_list)
+
+    # Updates the index to a new evolutions list - returns the number of base players searched again.
+    # A removed evolution only affects the base players with an indexed path containing it - it was available in
+    # none of the states of the others. An added evolution only affects the base players with evolved players that
+    # may do it (see prefilter.rows_may_use). The paths of the affected base players are replaced, the rest of the
+    # index is kept as is
+    def update(self, table: PlayerTable, evo_list: list):
+        old_evos = self._meta('evos')
+        if (old_evos is None or self._meta('table') != table.fingerprint() or  # Not built, or built over another table
+                self._meta('vocabulary') != VOCABULARY_HASH):  # or with other positions and playstyles bits
+            self.build(table, evo_list)
+            return len(table)
+
+        new_evos = {evolution.name: _evo_fingerprint(evolution) for evolution in evo_list}
+        removed = [evo_name for evo_name, fingerprint in old_evos.items() if new_evos.get(evo_name) != fingerprint]
+        added = [evolution for evolution in evo_list if old_evos.get(evolution.name) != new_evos[evolution.name]]
+
+        affected = set(rows_may_use(table, added, evo_list).tolist()) if added else set()
+        for evo_name in removed:
+            affected.update(base_id for base_id, in self.conn.execute(
+                "SELECT DISTINCT base_id FROM evolved WHERE instr(evolutions, ?) > 0", (f"|{evo_name}|",)))
+
+        with self.conn:  # One transaction
+            self.conn.executemany("DELETE FROM evolved WHERE base_id = ?", ((base_id,) for base_id in affected))
+            self._insert_paths(table, evo_list, sorted(affected))
+            self._set_meta(table, evo_list)
+
+        return len(affected)
+
+    # Yields the indexed evolved players meeting the conditions - gets the conditions of Player.eval_cond.
+    # evo_list - the evolutions the index was built with, for the players evolutions
+    def query(self, evo_list: list, name='', min_pac=0, min_sho=0, min_pas=0, min_dri=0, min_def=0, min_phy=0,
+              min_ovr=0, min_skills=0, min_wf=0, wanted_positions=None, playstyle_plus='', wanted_playstyles=None,
+              att_wr='', def_wr='', wanted_evos=None):
+        evo_by_name = {evolution.name: evolution for evolution in evo_list}
+        fingerprints = {evolution.name: _evo_fingerprint(evolution) for evolution in evo_list}
+        if fingerprints != self._meta('evos'):  # Other evolutions, or the same names with other definitions
+            raise ValueError("The paths index was not built with this evolutions list")
+        if self._meta('vocabulary') != VOCABULARY_HASH:  # Stored bitmasks decode to other names
+            raise ValueError("The paths index was built with other positions and playstyles - rebuild it")
+
+        where, params = [], []
+        for col, min_val in (('_ovr', min_ovr), ('_pac', min_pac), ('_sho', min_sho), ('_pas', min_pas),
+                             ('_dri', min_dri), ('_def', min_def), ('_phy', min_phy), ('skills', min_skills),
+                             ('wf', min_wf)):
+            if min_val:
+                where.append(f"{col} >= ?")
+                params.append(min_val)
+
+        for col, val in (('playstyle_plus', playstyle_plus), ('att_wr', att_wr), ('def_wr', def_wr)):
+            if val != '':
+                where.append(f"{col} = ?")
+                params.append(val)
+
+        if name != '':
+            where.append("instr(name, ?) > 0")
+            params.append(name)
+
+        if wanted_positions is not None:
+            where.append("positions & ? != 0")
+            params.append(positions_mask(frozenset(wanted_positions)))
+
+        if wanted_playstyles is not None:
+            where.append("playstyles & ? != 0")
+            params.append(playstyles_mask(frozenset(wanted_playstyles)))
+
+        if wanted_evos is not None:  # Any of the desired evolutions in path
+            where.append(f"({' OR '.join('instr(evolutions, ?) > 0' for _ in wanted_evos) or '0'})")
+            params += [f"|{evolution.name}|" for evolution in wanted_evos]
+
+        sql = f"SELECT {', '.join(COLUMNS[1:])} FROM evolved"
+        if where:
+            sql += f" WHERE {' AND '.join(where)}"
+
+        for row in self.conn.execute(sql, params):  # Row stats are in STATS order
+            yield Player(row[0], row[2], row[3], row[4], row[5], row[6], row[7], row[1], row[8], row[9],
+                         row[10], row[11], row[12], row[13], row[14], row[15],
+                         [evo_by_name[evo_name] for evo_name in row[16].strip('|').split('|')])
+
+
+if __name__ == '__main__':
+    # Build step - index all the evolution paths of the players database with the current evolutions.
+    # An existing index is updated incrementally to the changes in curr_evos
+    from evo import curr_evos
+
+    index = PathIndex('evo_paths.db')
+    searched = index.update(load_players('eafc_players_final.csv'), curr_evos)
+    print(f"Searched {searched} base players, "
+          f"indexed {index.conn.execute('SELECT COUNT(*) FROM evolved').fetchone()[0]} evolved players")
+    index.close()
@@ -1,13 +1,19 @@
-from utils import are_evo_lists_equal
+from operator import attrgetter
+from utils import positions_mask, playstyles_mask, positions_set, playstyles_set, STATS, MAX_STAT, MAX_STARS
+from search import PathSearch
 
-MAX_STAT = 99
-MAX_STARS = 5
+get_stat_vector = attrgetter(*STATS)  # Player stats as a tuple in STATS order
 
 
 class Player:
+    # Fixed fields - keeps the player record compact, as a new one is created for every evolution
+    __slots__ = ('name', '_pac', '_sho', '_pas', '_dri', '_def', '_phy', '_ovr', 'skills', 'wf', 'positions',
+                 'playstyle_plus', 'playstyles', 'att_wr', 'def_wr', 'rarity', 'evolutions', 'used', '_key')
+
+    # used - the used evolutions mask of the evolutions (see Evo.add_use), computed from them if None
     def __init__(self, name: str, _pac: int, _sho: int, _pas: int, _dri: int, _def: int, _phy: int, _ovr: int,
-                 skills: int, wf: int, positions: set, playstyle_plus: str, playstyles: set, att_wr: str, def_wr: str,
-                 rarity: str, evolutions: list):
+                 skills: int, wf: int, positions: int, playstyle_plus: str, playstyles: int, att_wr: str, def_wr: str,
+                 rarity: str, evolutions: list, used=None):
         self.name = name
         self._pac = _pac
         self._sho = _sho
@@ -18,13 +24,19 @@ class Player:
         self._ovr = _ovr
         self.skills = skills
         self.wf = wf
-        self.positions = positions
+        self.positions = positions  # Positions bitmask (utils.POSITION_BITS) - names are for display only
         self.playstyle_plus = playstyle_plus
-        self.playstyles = playstyles
+        self.playstyles = playstyles  # PlayStyles bitmask (utils.PLAYSTYLE_BITS)
         self.att_wr = att_wr
         self.def_wr = def_wr
         self.rarity = rarity
-        self.evolutions = evolutions
+        self.evolutions = tuple(evolutions)
+        if used is None:
+            used = 0
+            for done_evo in self.evolutions:
+                used = done_evo.add_use(used)
+        self.used = used  # Times each evolution was done, as a bitmask - one bit test per "used" check
+        self._key = None  # Cached state key - reset by every add_* update
 
     def __str__(self):
         return (f"Player: {self.name}  OVR: {self._ovr}\n"
@@ -33,29 +45,38 @@ class Player:
                 f"Pas: {self._pas}  Phy: {self._phy}\n"
                 f"Skills: {self.skills} Weak foot: {self.wf}\n"
                 f"Playstyle+ : {self.playstyle_plus}\n"
-                f"Playstyles: {self.playstyles}\n"
-                f"Positions: {self.positions}\n"
+                f"Playstyles: {set(playstyles_set(self.playstyles))}\n"
+                f"Positions: {set(positions_set(self.positions))}\n"
                 f"Attacking/Defensive Work rate: {self.att_wr}/{self.def_wr}\n"
                 f"Rarity: {self.rarity}\n"
-                f"Evolutions: {self.evolutions}\n")
+                f"Evolutions: {list(self.evolutions)}\n")
 
-    # Overload hash for "set" purpose
+    # Overload hash for "set" purpose - hash of the cached state key
     def __hash__(self):
-        return hash(self.name)
+        return hash(self.state_key())
 
-    # Overload equals for "set" purpose
+    # Overload equals for "set" purpose - same state key
     def __eq__(self, other):
-        # First check the name of the player and then the evolution list
-        return (isinstance(other, Player) and self.name == other.name
-                and are_evo_lists_equal(self.evolutions, other.evolutions) and self._pac == other._pac
-                and self._sho == other._sho and self._pas == other._pas and self._dri == other._dri
-                and self._def == other._def and self._phy == other._phy and self.skills == other.skills
-                and self.wf == other.wf and self.playstyles == other.playstyles and self.positions == other.positions
-                and self.playstyle_plus == other.playstyle_plus and self.att_wr == other.att_wr
-                and self.def_wr == other.def_wr)
+        return isinstance(other, Player) and self.state_key() == other.state_key()
+
+    # Canonical state of the player - the evolutions done are taken as an unordered multiset (the used evolutions
+    # mask). Computed once and cached until the player is updated
+    def state_key(self):
+        if self._key is None:
+            self._key = (self.name, self._pac, self._sho, self._pas, self._dri, self._def, self._phy, self._ovr,
+                         self.skills, self.wf, self.positions, self.playstyle_plus, self.playstyles, self.att_wr,
+                         self.def_wr, self.rarity, self.used)
+        return self._key
+
+    # Returns a shallow copy of the player - all fields are immutable, so no memory is shared mutably
+    def copy(self):
+        return Player(self.name, self._pac, self._sho, self._pas, self._dri, self._def, self._phy, self._ovr,
+                      self.skills, self.wf, self.positions, self.playstyle_plus, self.playstyles, self.att_wr,
+                      self.def_wr, self.rarity, self.evolutions, self.used)
 
     # Adds player stat (ovr, pac, sho, pas, dri, def, phy)
     def add_stat(self, stat_name: str, val: int):
+        self._key = None
         curr_value = getattr(self, stat_name)
         if curr_value + val >= MAX_STAT:
             setattr(self, stat_name, MAX_STAT)
@@ -64,27 +85,32 @@ class Player:
 
     # Adds player star value (skills, wf)
     def add_star(self, star_name: str, val: int):
+        self._key = None
         curr_value = getattr(self, star_name)
         if curr_value + val >= MAX_STARS:
             setattr(self, star_name, MAX_STARS)
         else:
             setattr(self, star_name, curr_value + val)
 
-    # Add positions to set
-    def add_positions(self, positions: set):
-        self.positions.update(positions)
+    # Add positions of a positions bitmask
+    def add_positions(self, positions: int):
+        self._key = None
+        self.positions |= positions
 
-    # Add playstyles to set
-    def add_playstyles(self, new_playstyles: set):
-        self.playstyles.update(new_playstyles)
+    # Add playstyles of a playstyles bitmask
+    def add_playstyles(self, new_playstyles: int):
+        self._key = None
+        self.playstyles |= new_playstyles
 
     # Update playstyle plus only if current is None
     def add_playstyle_plus(self, name: str):
+        self._key = None
         if self.playstyle_plus == "None":
             self.playstyle_plus = name
 
     # Update work rate - can be "att" or "def" work rate
     def add_wr(self, wr_name: str, val: str):
+        self._key = None
         if "att" in wr_name:
             self.att_wr = val
         else:
@@ -92,21 +118,24 @@ class Player:
 
     # Append evolution to list
     def add_evo(self, done_evo):
-        self.evolutions.append(done_evo)
+        self._key = None
+        self.evolutions = self.evolutions + (done_evo,)
+        self.used = done_evo.add_use(self.used)
 
     # Update rarity
     def add_rarity(self, rarity: str):
+        self._key = None
         self.rarity = rarity
 
+    # Returns the player stats vector, ordered as utils.STATS
+    def stat_vector(self):
+        return get_stat_vector(self)
+
     # Returns a list of the available evolutions for the current player out of evo_list
     def get_avail_evos(self, evo_list: list):
-        avail_evos = list()
-
-        for evolution in evo_list:  # Iterate over current evolutions in the game
-            if evolution.is_evo_able(self):
-                avail_evos.append(evolution)
+        stats = self.stat_vector()  # Computed once for all the evolutions checks
 
-        return avail_evos
+        return [evolution for evolution in evo_list if evolution.req_check.fits(self, stats, self.positions)]
 
     # Gets conditions and returns T/F if the player match them
     def eval_cond(self, name='', min_pac=0, min_sho=0, min_pas=0, min_dri=0, min_def=0, min_phy=0, min_ovr=0,
@@ -126,11 +155,11 @@ class Player:
             return False
 
         if wanted_positions is not None:
-            if wanted_positions.isdisjoint(self.positions):  # No desired position for this player
+            if not positions_mask(frozenset(wanted_positions)) & self.positions:  # No desired position for this player
                 return False
 
         if wanted_playstyles is not None:
-            if wanted_playstyles.isdisjoint(self.playstyles):  # No desired playstyle for this player
+            if not playstyles_mask(frozenset(wanted_playstyles)) & self.playstyles:  # No desired playstyle
                 return False
 
         if playstyle_plus != '':
@@ -147,14 +176,8 @@ class Player:
 
         return True
 
-    # Recursive algorithm to find all evo paths for a player under a condition - updates evolved players caught in set
-    def update_evo_paths(self, player_set: set, evo_list: list,  **kwargs):
-        avail_evos = self.get_avail_evos(evo_list)
-        if not avail_evos:  # Checks if available evolutions list of the player is empty - path end
-            if self.evolutions and self.eval_cond(**kwargs):  # Evolved player and conditions met for him
-                player_set.add(self)  # Add the evolved player to set
-            return
-
-        for avail_evo in avail_evos:  # Iterate over available evolutions for the player
-            evo_player = avail_evo.evolve(self)
-            evo_player.update_evo_paths(player_set, evo_list, **kwargs)  # Recursively expand the evolution path
+    # Finds all evo paths for a player under a condition - updates evolved players caught in set.
+    # Each reachable state is expanded once, regardless of the order its evolutions were done in.
+    # Gets the search limits of PathSearch too - returns False if the search was cut by a limit
+    def update_evo_paths(self, player_set: set, evo_list: list, **kwargs):
+        return PathSearch(evo_list, **kwargs).run(self, player_set)
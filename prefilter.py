@@ -0,0 +1,166 @@
+import numpy as np
+from dataset import PlayerTable
+from utils import MAX_STAT, MAX_STARS, positions_mask, playstyles_mask
+
+'''
+Vectorized pre-filter of the players table - drops the rows that can't start any evolution path,
+or that can't reach the wanted conditions even in the best case, before any Player object is created.
+Evolutions only raise stats and stars and only add positions and playstyles, so an evolution whose
+max stat, max playstyles, no playstyle plus or no positions requirement is broken by a base player
+can never be done by any of his evolved players either.
+'''
+
+
+# Per row features of the base players used by the requirements checks
+def _row_features(table: PlayerTable):
+    stats = np.asarray(table.stats, dtype=np.int16)  # Room for the upgrades sums
+    ovr = stats[:, 0]
+    rarity = np.where(ovr >= 75, 'Gold', np.where(ovr >= 65, 'Silver', 'Bronze'))  # As utils.get_rarity
+    no_ps_plus = table.playstyle_plus == 'None'
+
+    return stats, np.asarray(table.positions), np.asarray(table.n_playstyles), rarity, no_ps_plus
+
+
+# Boolean column of the rows that are not blocked for good from an evolution (see module notes)
+def _can_ever_fit(req_check, stats, pos_mask, n_playstyles, no_ps_plus):
+    fits = (stats <= np.array(req_check.max_stats)).all(axis=1)
+    fits &= (pos_mask & req_check.no_positions) == 0
+    if req_check.max_playstyles is not None:
+        fits &= n_playstyles <= req_check.max_playstyles
+    if req_check.no_playstyle_plus:
+        fits &= no_ps_plus
+
+    return fits
+
+
+# Boolean column of the rows fitting all the requirements of an evolution as base players
+def _fits_now(req_check, stats, pos_mask, n_playstyles, rarity, no_ps_plus):
+    fits = _can_ever_fit(req_check, stats, pos_mask, n_playstyles, no_ps_plus)
+    fits &= (stats >= np.array(req_check.min_stats)).all(axis=1)
+    if req_check.positions:
+        fits &= (pos_mask & req_check.positions) != 0
+    if req_check.rarity is not None:
+        fits &= rarity == req_check.rarity
+
+    return fits
+
+
+# Boolean column of the rows that have, or may get from one of their usable evolutions (upg_attr - Evo upgrades
+# bitmask attribute), a bit of a mask column
+def _may_have_any(masks: np.ndarray, usable: np.ndarray, evo_list: list, upg_attr: str, wanted_mask: int):
+    has = (masks & wanted_mask) != 0
+    for i, evolution in enumerate(evo_list):
+        if getattr(evolution, upg_attr) & wanted_mask:
+            has |= usable[:, i]
+
+    return has
+
+
+# Boolean column of the rows that have, or may get from one of their usable evolutions, a value of a str column
+def _may_have_val(values: np.ndarray, usable: np.ndarray, evo_list: list, upg_key: str, wanted: str, base_ok=None):
+    has = values == wanted
+    for i, evolution in enumerate(evo_list):
+        if evolution.upg.get(upg_key) == wanted:
+            has |= usable[:, i] if base_ok is None else usable[:, i] & base_ok
+
+    return has
+
+
+# Returns the indices of the rows of the players table that may end as an evolved player meeting the conditions.
+# Takes the same conditions as Player.eval_cond
+def filter_players(table: PlayerTable, evo_list: list, name='', min_pac=0, min_sho=0, min_pas=0, min_dri=0,
+                   min_def=0, min_phy=0, min_ovr=0, min_skills=0, min_wf=0, wanted_positions=None,
+                   playstyle_plus='', wanted_playstyles=None, att_wr='', def_wr='', wanted_evos=None):
+    if not evo_list or (wanted_evos is not None and set(wanted_evos).isdisjoint(evo_list)):
+        return np.arange(0)  # No evolution path can be found
+
+    stats, pos_mask, n_playstyles, rarity, no_ps_plus = _row_features(table)
+
+    # Rows that can start a path - fit at least one evolution as base players
+    keep = np.zeros(len(table), dtype=bool)
+    for evolution in evo_list:
+        keep |= _fits_now(evolution.req_check, stats, pos_mask, n_playstyles, rarity, no_ps_plus)
+
+    # Best case of each row - all the evolutions it is not blocked from are done
+    usable = np.column_stack([_can_ever_fit(evolution.req_check, stats, pos_mask, n_playstyles, no_ps_plus)
+                              for evolution in evo_list])
+    repeats = np.array([evolution.repeat for evolution in evo_list])  # A stackable evolution upgrades repeat times
+    upg_stats = np.array([evolution.upg_stats for evolution in evo_list]) * repeats[:, None]
+    best_stats = np.minimum(stats + usable.astype(np.int16) @ upg_stats, MAX_STAT)
+    min_stats = np.array([min_ovr, min_pac, min_sho, min_pas, min_dri, min_def, min_phy])  # STATS order
+    keep &= (best_stats >= min_stats).all(axis=1)
+
+    if wanted_evos is not None:  # Must not be blocked from all the desired evolutions
+        keep &= usable[:, [i for i, evolution in enumerate(evo_list) if evolution in wanted_evos]].any(axis=1)
+
+    for star, min_star in (('skills', min_skills), ('wf', min_wf)):
+        if min_star:
+            upg_star = np.array([evolution.upg.get(star, 0) for evolution in evo_list]) * repeats
+            keep &= np.minimum(getattr(table, star) + usable @ upg_star, MAX_STARS) >= min_star
+
+    if name != '':
+        keep &= np.char.find(table.name, name) >= 0
+
+    if wanted_positions is not None:
+        keep &= _may_have_any(pos_mask, usable, evo_list, 'upg_positions', positions_mask(frozenset(wanted_positions)))
+
+    if wanted_playstyles is not None:
+        keep &= _may_have_any(np.asarray(table.playstyles), usable, evo_list, 'upg_playstyles',
+                              playstyles_mask(frozenset(wanted_playstyles)))
+
+    if playstyle_plus != '':  # Playstyle plus is only granted to players with none
+        keep &= _may_have_val(table.playstyle_plus, usable, evo_list, 'playstyle_plus', playstyle_plus,
+                              base_ok=no_ps_plus)
+
+    if att_wr != '':
+        keep &= _may_have_val(table.att_wr, usable, evo_list, 'att_wr', att_wr)
+
+    if def_wr != '':
+        keep &= _may_have_val(table.def_wr, usable, evo_list, 'def_wr', def_wr)
+
+    return np.flatnonzero(keep)
+
+
+# Boolean matrix of rows x evolutions - False where no evolved player of the row can do the evolution. A row is not
+# blocked from a usable evolution for good, and the best case of its usable evolutions (all of them done) reaches the
+# evolution's min stats, positions and rarity. Refined until stable - an evolution needing what only evolutions
+# dropped by the last pass grant is dropped by the next one
+def _usable(table: PlayerTable, evo_list: list):
+    stats, pos_mask, n_playstyles, rarity, no_ps_plus = _row_features(table)
+    usable = np.zeros((len(table), len(evo_list)), dtype=bool)
+    for i, evolution in enumerate(evo_list):
+        usable[:, i] = _can_ever_fit(evolution.req_check, stats, pos_mask, n_playstyles, no_ps_plus)
+
+    repeats = np.array([evolution.repeat for evolution in evo_list], dtype=np.int16)
+    upg_stats = np.array([evolution.upg_stats for evolution in evo_list], dtype=np.int16).reshape(-1, 7)
+    upg_stats *= repeats[:, None]
+    upg_positions = np.array([evolution.upg_positions for evolution in evo_list], dtype=np.int64)
+    while True:
+        best_stats = np.minimum(stats + usable.astype(np.int16) @ upg_stats, MAX_STAT)
+        best_positions = pos_mask | np.bitwise_or.reduce(np.where(usable, upg_positions, 0), axis=1)
+
+        refined = usable.copy()
+        for i, evolution in enumerate(evo_list):
+            req_check = evolution.req_check
+            refined[:, i] &= (best_stats >= np.array(req_check.min_stats)).all(axis=1)
+            if req_check.positions:
+                refined[:, i] &= (best_positions & req_check.positions) != 0
+            if req_check.rarity is not None:
+                granting = [j for j, other in enumerate(evo_list) if other.upg.get('rarity') == req_check.rarity]
+                refined[:, i] &= (rarity == req_check.rarity) | usable[:, granting].any(axis=1)
+
+        if (refined == usable).all():
+            return usable
+        usable = refined
+
+
+# Returns the indices of the rows of the players table with evolved players that may do at least one of the
+# evolutions of evo_list. with_evos - the whole evolutions list searched (default evo_list), the evolutions that may
+# be done on the way
+def rows_may_use(table: PlayerTable, evo_list: list, with_evos=None):
+    if with_evos is None:
+        with_evos = evo_list
+    usable = _usable(table, with_evos)
+    cols = [i for i, evolution in enumerate(with_evos) if evolution in evo_list]
+
+    return np.flatnonzero(usable[:, cols].any(axis=1))
@@ -0,0 +1,210 @@
+import argparse
+import cProfile
+import json
+import time
+from collections import Counter
+from search import PathSearch
+
+'''
+Opt-in search cost instrumentation - a profiled search counts the expanded nodes, the requirements checks and their
+rejections by requirement key, and times Evo.evolve, per base player and per evolution. The plain PathSearch is left
+untouched, so the search pays nothing when not profiled. A profile prints a summary report of the players and
+evolutions dominating the search, and may be dumped as a JSON trace or as cProfile stats (pstats).
+'''
+
+
+# Search cost of one base player
+class PlayerCost:
+    __slots__ = ('name', 'ovr', 'nodes', 'repeats', 'pruned', 'path_ends', 'found', 'max_depth', 'evolve_time',
+                 'time')
+
+    def __init__(self, base_player):
+        self.name = base_player.name
+        self.ovr = base_player._ovr
+        self.nodes = 0  # Expanded states
+        self.repeats = 0  # States reached again and skipped (transposition table hits)
+        self.pruned = 0  # States cut by the conditions bound
+        self.path_ends = 0  # States with no available evolution
+        self.found = 0  # Path ends meeting the conditions
+        self.max_depth = 0  # Longest path
+        self.evolve_time = 0.0
+        self.time = 0.0  # Search time, without the time the caller spent between found players
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+# Search cost of one evolution over all the profiled players
+class EvoCost:
+    __slots__ = ('checks', 'rejected', 'evolves', 'evolve_time')
+
+    def __init__(self):
+        self.checks = 0  # Requirements checks
+        self.rejected = Counter()  # Failed checks by the key of the first failed requirement
+        self.evolves = 0
+        self.evolve_time = 0.0
+
+    def to_dict(self):
+        return {'checks': self.checks, 'rejected': dict(self.rejected.most_common()), 'evolves': self.evolves,
+                'evolve_time': self.evolve_time}
+
+
+class SearchProfile:
+    def __init__(self, cprofile=False):
+        self.players = []  # PlayerCost of every searched base player, in search order
+        self.evos = {}  # EvoCost by evolution name
+        self.cprofiler = cProfile.Profile() if cprofile else None  # Function level profile of the search only
+
+    # Creates a search over the evolutions list that records its costs in this profile
+    def search(self, evo_list: list, **kwargs):
+        for evolution in evo_list:
+            self.evos.setdefault(evolution.name, EvoCost())
+        return ProfiledSearch(self, evo_list, **kwargs)
+
+    def totals(self):
+        total = {'players': len(self.players)}
+        for field in ('nodes', 'repeats', 'pruned', 'path_ends', 'found', 'evolve_time', 'time'):
+            total[field] = sum(getattr(cost, field) for cost in self.players)
+        total['checks'] = sum(cost.checks for cost in self.evos.values())
+        total['nodes_per_sec'] = total['nodes'] / total['time'] if total['time'] else 0.0
+        return total
+
+    # Summary report - totals, the top most expensive players and the evolutions by evolve time
+    def report(self, top=10):
+        total = self.totals()
+        rejected = sum((cost.rejected for cost in self.evos.values()), Counter())
+        lines = [f"Players: {total['players']}, nodes: {total['nodes']} ({total['nodes_per_sec']:.0f}/s), "
+                 f"repeated states: {total['repeats']}, pruned: {total['pruned']}, path ends: {total['path_ends']}, "
+                 f"found: {total['found']}",
+                 f"Search time: {total['time']:.3f}s, in Evo.evolve: {total['evolve_time']:.3f}s",
+                 f"Requirements checks: {total['checks']}, rejected: {sum(rejected.values())} "
+                 f"({', '.join(f'{key} {count}' for key, count in rejected.most_common())})",
+                 '', f"Top {top} players by search time:"]
+
+        for cost in sorted(self.players, key=lambda player_cost: player_cost.time, reverse=True)[:top]:
+            lines.append(f"  {cost.name} ({cost.ovr}): {cost.time:.4f}s, {cost.nodes} nodes, {cost.repeats} repeated, "
+                         f"{cost.pruned} pruned, depth {cost.max_depth}, {cost.found} found")
+
+        lines += ['', "Evolutions by evolve time:"]
+        for evo_name, cost in sorted(self.evos.items(), key=lambda item: item[1].evolve_time, reverse=True):
+            lines.append(f"  {evo_name}: {cost.evolves} evolves in {cost.evolve_time:.4f}s, {cost.checks} checks, "
+                         f"rejected {', '.join(f'{key} {count}' for key, count in cost.rejected.most_common(3))}")
+
+        return '\n'.join(lines)
+
+    # Writes the full counters as JSON - totals, every player and every evolution
+    def dump_trace(self, path: str):
+        with open(path, 'w') as f:
+            json.dump({'totals': self.totals(), 'players': [cost.to_dict() for cost in self.players],
+                       'evos': {evo_name: cost.to_dict() for evo_name, cost in self.evos.items()}}, f, indent=1)
+
+    # Writes the cProfile stats of the search, readable with pstats - needs cprofile=True
+    def dump_stats(self, path: str):
+        if self.cprofiler is None:
+            raise ValueError("The profile was created without cprofile")
+        self.cprofiler.dump_stats(path)
+
+
+# PathSearch that counts and times its work into a SearchProfile - finds the same players as PathSearch
+class ProfiledSearch(PathSearch):
+    def __init__(self, profile: SearchProfile, evo_list: list, **kwargs):
+        super().__init__(evo_list, **kwargs)
+        self.profile = profile
+        self.cost = None  # PlayerCost of the player searched now
+
+    def iter_paths(self, base_player):
+        self.cost = PlayerCost(base_player)
+        self.profile.players.append(self.cost)
+        paths = super().iter_paths(base_player)
+        cprofiler = self.profile.cprofiler
+
+        while True:  # Only the time spent in the search counts, not the time of the caller between found players
+            start = time.perf_counter()
+            if cprofiler is not None:
+                cprofiler.enable()
+            try:
+                evo_player = next(paths, None)
+            finally:
+                if cprofiler is not None:
+                    cprofiler.disable()
+                self.cost.time += time.perf_counter() - start
+
+            if evo_player is None:
+                return
+            self.cost.found += 1
+            yield evo_player
+
+    # Records a failed requirements check by the key of the first failed requirement
+    def _reject(self, evolution, _player, stats: tuple, pos_mask: int):
+        self.profile.evos[evolution.name].rejected[evolution.req_check.failed(_player, stats, pos_mask)] += 1
+
+    # PathSearch._expand with counters
+    def _expand(self, _player, expanded: set):
+        key = _player.state_key()
+        if key in expanded:
+            self.cost.repeats += 1
+            return None
+        expanded.add(key)
+        self.cost.nodes += 1
+        self.cost.max_depth = max(self.cost.max_depth, len(_player.evolutions))
+
+        stats = _player.stat_vector()
+        pos_mask = _player.positions
+        remaining = []
+        for evolution in self.evo_list:  # Each evolution is checked once per state
+            self.profile.evos[evolution.name].checks += 1
+            if evolution.req_check.blocked(_player, stats, pos_mask):
+                self._reject(evolution, _player, stats, pos_mask)
+            else:
+                remaining.append(evolution)
+        if self.bound.active and not self.bound.reachable(_player, stats, remaining):
+            self.cost.pruned += 1
+            return None
+
+        avail_evos = []
+        for evolution in remaining:
+            if evolution.req_check.ready(_player, stats, pos_mask):
+                avail_evos.append(evolution)
+            else:
+                self._reject(evolution, _player, stats, pos_mask)
+        if not avail_evos:
+            self.cost.path_ends += 1
+
+        return avail_evos
+
+    def _evolve(self, evolution, _player):
+        evo_cost = self.profile.evos[evolution.name]
+        start = time.perf_counter()
+        evo_player = evolution.evolve(_player)
+        elapsed = time.perf_counter() - start
+        evo_cost.evolves += 1
+        evo_cost.evolve_time += elapsed
+        self.cost.evolve_time += elapsed
+        return evo_player
+
+
+if __name__ == '__main__':
+    # Profiles the search of main.py - the evolved players are counted, not printed
+    from dataset import load_players
+    from evo import curr_evos
+    from prefilter import filter_players
+
+    parser = argparse.ArgumentParser(description="Profile the evolution paths search")
+    parser.add_argument('--top', type=int, default=10, help="number of most expensive players to report")
+    parser.add_argument('--trace', metavar='JSON_FILE', help="write the full counters as a JSON trace")
+    parser.add_argument('--pstats', metavar='PROF_FILE', help="write cProfile stats of the search")
+    args = parser.parse_args()
+
+    cond = {'min_skills': 5, 'min_wf': 5}
+    table = load_players('eafc_players_final.csv')
+    profile = SearchProfile(cprofile=args.pstats is not None)
+    search = profile.search(curr_evos, **cond)
+    for i in filter_players(table, curr_evos, **cond):
+        for _ in search.iter_paths(table.player(i)):
+            pass
+
+    print(profile.report(top=args.top))
+    if args.trace:
+        profile.dump_trace(args.trace)
+    if args.pstats:
+        profile.dump_stats(args.pstats)
@@ -0,0 +1,240 @@
+import numpy as np
+from dataset import PlayerTable
+from prefilter import filter_players
+from utils import MAX_STAT, MAX_STARS, positions_mask, playstyles_mask
+
+'''
+Reverse search - finds the base players that can reach a target evolved profile (the conditions of Player.eval_cond)
+without searching each player's paths. Evolutions raise stats and stars by fixed amounts, so along an evolution
+sequence every requirement and every target condition is a window on the base player's columns (e.g. a max stat
+requirement after +8 is the base stat at most max - 8). The sequences are searched once for the whole table: each
+step keeps the rows inside the windows of its evolution with vectorized range filters, and a sequence is dropped
+as soon as no row is left. Rows meeting the target windows after a sequence are found and are not searched again.
+'''
+
+
+# State of an evolution sequence - the sums of its upgrades, independent of the base player
+class _Sequence:
+    __slots__ = ('names', 'stats', 'skills', 'wf', 'positions', 'playstyles', 'playstyle_plus', 'att_wr', 'def_wr',
+                 'rarity')
+
+    def __init__(self):
+        self.names = ()  # Evolution names in order
+        self.stats = np.zeros(7, dtype=np.int16)  # Stats upgrades sums in STATS order
+        self.skills = 0
+        self.wf = 0
+        self.positions = 0  # Positions and playstyles masks gained
+        self.playstyles = 0
+        self.playstyle_plus = None  # First playstyle plus granted - the one kept (see Player.add_playstyle_plus)
+        self.att_wr = None  # Last work rates and rarity granted, None - the base player's
+        self.def_wr = None
+        self.rarity = None
+
+    # Sequence extended by an evolution
+    def then(self, evolution):
+        seq = _Sequence()
+        seq.names = self.names + (evolution.name,)
+        seq.stats = self.stats + evolution.upg_stats
+        seq.skills = self.skills + evolution.upg.get('skills', 0)
+        seq.wf = self.wf + evolution.upg.get('wf', 0)
+        seq.positions = self.positions | evolution.upg_positions
+        seq.playstyles = self.playstyles | evolution.upg_playstyles
+        seq.playstyle_plus = self.playstyle_plus or evolution.upg.get('playstyle_plus')
+        seq.att_wr = evolution.upg.get('att_wr', self.att_wr)
+        seq.def_wr = evolution.upg.get('def_wr', self.def_wr)
+        seq.rarity = evolution.upg.get('rarity', self.rarity)
+        return seq
+
+    # Times an evolution was done in the sequence
+    def used(self, evolution):
+        return self.names.count(evolution.name)
+
+    # Sequences of the same evolutions in another order end in the same upgrades, unless they grant work rates or
+    # rarity in another order
+    def key(self):
+        return tuple(sorted(self.names)), self.playstyle_plus, self.att_wr, self.def_wr, self.rarity
+
+
+# Base players columns - a search step looks up the rows it keeps. Requirements checks on the base player only are
+# computed once for every evolution
+class _Columns:
+    def __init__(self, table: PlayerTable, evo_list: list):
+        self.stats = np.asarray(table.stats, dtype=np.int16)  # Room for the upgrades sums
+        self.skills = np.asarray(table.skills, dtype=np.int16)
+        self.wf = np.asarray(table.wf, dtype=np.int16)
+        self.positions = np.asarray(table.positions)
+        self.playstyles = np.asarray(table.playstyles)
+        self.n_playstyles = np.asarray(table.n_playstyles)
+        self.playstyle_plus = np.asarray(table.playstyle_plus)
+        self.att_wr = np.asarray(table.att_wr)
+        self.def_wr = np.asarray(table.def_wr)
+        ovr = self.stats[:, 0]
+        rarity = np.where(ovr >= 75, 'Gold', np.where(ovr >= 65, 'Silver', 'Bronze'))  # As utils.get_rarity
+
+        self.base_fits = {}  # Evolution name: rows fitting its requirements that no evolution can change
+        self.base_positions = {}  # Evolution name: rows with one of its required positions
+        self.base_rarity = {}  # Evolution name: rows of its required rarity, while no rarity is granted
+        for evolution in evo_list:
+            req_check = evolution.req_check
+            fits = (self.positions & req_check.no_positions) == 0
+            if req_check.no_playstyle_plus:
+                fits &= self.playstyle_plus == 'None'
+            self.base_fits[evolution.name] = fits
+            self.base_positions[evolution.name] = (self.positions & req_check.positions) != 0
+            self.base_rarity[evolution.name] = rarity == req_check.rarity
+
+
+# Boolean column of the rows fitting the requirements of an evolution after an evolution sequence.
+# stats - the rows stats after the sequence
+def _step_fits(evolution, seq: _Sequence, cols: _Columns, rows: np.ndarray, stats: np.ndarray):
+    req_check = evolution.req_check
+    if req_check.no_positions & seq.positions:  # A position gained on the way is not allowed
+        return np.zeros(len(rows), dtype=bool)
+    if req_check.no_playstyle_plus and seq.playstyle_plus is not None:  # Playstyle plus granted on the way
+        return np.zeros(len(rows), dtype=bool)
+    if req_check.rarity is not None and seq.rarity is not None and seq.rarity != req_check.rarity:
+        return np.zeros(len(rows), dtype=bool)
+
+    fits = cols.base_fits[evolution.name][rows]
+    fits &= (stats <= req_check.max_stats).all(axis=1)
+    fits &= (stats >= req_check.min_stats).all(axis=1)
+
+    if req_check.positions and not req_check.positions & seq.positions:
+        fits &= cols.base_positions[evolution.name][rows]
+
+    if req_check.rarity is not None and seq.rarity is None:
+        fits &= cols.base_rarity[evolution.name][rows]
+
+    if req_check.max_playstyles is not None:  # Playstyles gained on the way and not had by the base player count
+        n_playstyles = cols.n_playstyles[rows]
+        if seq.playstyles:
+            playstyles = cols.playstyles[rows]
+            for bit in range(seq.playstyles.bit_length()):
+                if seq.playstyles >> bit & 1:
+                    n_playstyles = n_playstyles + ((playstyles >> bit) & 1 == 0)
+        fits &= n_playstyles <= req_check.max_playstyles
+
+    return fits
+
+
+# Target windows of the conditions - checked over the rows after a sequence
+class _Target:
+    def __init__(self, min_pac=0, min_sho=0, min_pas=0, min_dri=0, min_def=0, min_phy=0, min_ovr=0, min_skills=0,
+                 min_wf=0, wanted_positions=None, playstyle_plus='', wanted_playstyles=None, att_wr='', def_wr='',
+                 wanted_evos=None, name=''):
+        self.min_stats = np.array([min_ovr, min_pac, min_sho, min_pas, min_dri, min_def, min_phy])  # STATS order
+        self.min_skills = min_skills
+        self.min_wf = min_wf
+        self.positions = None if wanted_positions is None else positions_mask(frozenset(wanted_positions))
+        self.playstyles = None if wanted_playstyles is None else playstyles_mask(frozenset(wanted_playstyles))
+        self.playstyle_plus = playstyle_plus
+        self.att_wr = att_wr
+        self.def_wr = def_wr
+        self.wanted_evos = None if wanted_evos is None else {evolution.name for evolution in wanted_evos}
+
+    # Boolean column of the rows meeting the conditions after a sequence
+    def met(self, seq: _Sequence, cols: _Columns, rows: np.ndarray, stats: np.ndarray):
+        if self.wanted_evos is not None and self.wanted_evos.isdisjoint(seq.names):
+            return np.zeros(len(rows), dtype=bool)
+
+        met = (stats >= self.min_stats).all(axis=1)
+        if self.min_skills:
+            met &= np.minimum(cols.skills[rows] + seq.skills, MAX_STARS) >= self.min_skills
+        if self.min_wf:
+            met &= np.minimum(cols.wf[rows] + seq.wf, MAX_STARS) >= self.min_wf
+
+        if self.positions is not None and not self.positions & seq.positions:
+            met &= (cols.positions[rows] & self.positions) != 0
+        if self.playstyles is not None and not self.playstyles & seq.playstyles:
+            met &= (cols.playstyles[rows] & self.playstyles) != 0
+
+        if self.playstyle_plus != '':  # A granted playstyle plus is kept only by players with none
+            base = cols.playstyle_plus[rows]
+            met &= (base if seq.playstyle_plus is None else
+                    np.where(base == 'None', seq.playstyle_plus, base)) == self.playstyle_plus
+
+        for wanted_wr, seq_wr, base_wr in ((self.att_wr, seq.att_wr, cols.att_wr),
+                                           (self.def_wr, seq.def_wr, cols.def_wr)):
+            if wanted_wr != '':
+                met &= base_wr[rows] == wanted_wr if seq_wr is None else np.full(len(rows), seq_wr == wanted_wr)
+
+        return met
+
+    # Boolean column of the rows that may still meet the stats and stars conditions, doing all the unused evolutions
+    # each row is not blocked from for good (see prefilter)
+    def reachable(self, seq: _Sequence, cols: _Columns, rows: np.ndarray, stats: np.ndarray, unused: list):
+        usable = np.zeros((len(rows), len(unused)), dtype=np.int16)
+        for i, evolution in enumerate(unused):
+            req_check = evolution.req_check
+            if not (req_check.no_positions & seq.positions or req_check.no_playstyle_plus and seq.playstyle_plus):
+                usable[:, i] = cols.base_fits[evolution.name][rows] & (stats <= req_check.max_stats).all(axis=1)
+
+        best = stats + usable @ np.array([evolution.upg_stats for evolution in unused], dtype=np.int16).reshape(-1, 7)
+        reach = (np.minimum(best, MAX_STAT) >= self.min_stats).all(axis=1)
+        for star, min_star, seq_star in (('skills', self.min_skills, seq.skills), ('wf', self.min_wf, seq.wf)):
+            if min_star:
+                upg_star = np.array([evolution.upg.get(star, 0) for evolution in unused], dtype=np.int16)
+                reach &= np.minimum(getattr(cols, star)[rows] + seq_star + usable @ upg_star, MAX_STARS) >= min_star
+        return reach
+
+
+# Reverse search over a players table and an evolutions list - the columns are built once for many queries
+class ReverseSearch:
+    def __init__(self, table: PlayerTable, evo_list: list):
+        self.table = table
+        self.evo_list = evo_list
+        self.cols = _Columns(table, evo_list)
+
+    # Returns the indices of the rows of the players table that can reach the conditions (see Player.eval_cond) by
+    # an evolution sequence of the list, and the sequence found for each one as {row: evolution names}.
+    # Conditions only raised by evolutions are met at a path end once met on the way, so for them these are exactly
+    # the rows the forward search finds players of. Work rates may be granted again later, so for them the rows are
+    # a superset - the forward search of these rows alone gives the exact evolved players
+    def run(self, **kwargs):
+        evo_list, cols = self.evo_list, self.cols
+        target = _Target(**kwargs)
+        found = {}
+        is_found = np.zeros(len(self.table), dtype=bool)
+        searched = {}  # Transposition table - sequence key: rows already searched after a sequence of the key
+
+        # rows - rows still searched after the sequence, stats - their stats after it
+        def search(seq: _Sequence, rows: np.ndarray, stats: np.ndarray):
+            key = seq.key()
+            if key in searched:  # Only the rows not searched by another order of the same evolutions
+                new = ~searched[key][rows]
+                rows, stats = rows[new], stats[new]
+                if not len(rows):
+                    return
+            else:
+                searched[key] = np.zeros(len(self.table), dtype=bool)
+            searched[key][rows] = True
+
+            for evolution in evo_list:
+                if seq.used(evolution) >= evolution.repeat:  # An evolution is done up to repeat times
+                    continue
+                fits = _step_fits(evolution, seq, cols, rows, stats) & ~is_found[rows]  # Not found by an earlier one
+                if not fits.any():
+                    continue
+
+                step_seq = seq.then(evolution)
+                step_rows = rows[fits]
+                step_stats = np.minimum(stats[fits] + evolution.upg_stats, MAX_STAT)
+                met = target.met(step_seq, cols, step_rows, step_stats)
+                if met.any():
+                    for row in step_rows[met].tolist():
+                        found[row] = step_seq.names
+                    is_found[step_rows[met]] = True
+
+                unused = [other for other in evo_list for _ in range(other.repeat - step_seq.used(other))]
+                keep = ~met & target.reachable(step_seq, cols, step_rows, step_stats, unused)  # Found rows are done
+                if keep.any():
+                    search(step_seq, step_rows[keep], step_stats[keep])
+
+        rows = filter_players(self.table, evo_list, **kwargs)  # Best case and name filters of the prefilter
+        search(_Sequence(), rows, cols.stats[rows])
+        return np.array(sorted(found), dtype=np.int64), found
+
+
+# One reverse search query (see ReverseSearch.run)
+def reverse_search(table: PlayerTable, evo_list: list, **kwargs):
+    return ReverseSearch(table, evo_list).run(**kwargs)
@@ -2,9 +2,19 @@ from numpy import nan  # Missing dataset values
 import pandas as pd  # Data processing, CSV file I/O (e.g. pd.read_csv)
 import requests  # HTML request
 from bs4 import BeautifulSoup as bs  # HTML parsing
+from lxml import etree, html as lxml_html  # Fast HTML parsing with XPath
 import re  # Regex
-import time  # Time sleep for failed HTML requests
+import os  # Response cache file handling
+import json  # Response cache file format
+import hashlib  # Content hash of responses
+import time  # Rate limiting of HTML requests
+import threading  # Rate limiter lock
 import logging  # Logs management
+import argparse  # Command line options
+import sys  # Exit code of the parity check
+from urllib.parse import urlsplit  # Host of a request
+from concurrent.futures import ThreadPoolExecutor  # Concurrent HTML requests
+from requests.adapters import HTTPAdapter  # Connection pooling
 
 pd.set_option('display.max_columns', 50)
 
@@ -159,86 +169,403 @@ def scrape_playstyles(sp: bs):
 ''' Functions for scraping data in HTML using bs - END '''
 
 
-for page in range(1, 175):
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
-                             'Chrome/91.0.4472.124 Safari/537.36'}
-    absolute = "https://www.ea.com"
-    url = f"https://www.ea.com/games/ea-sports-fc/ratings?page={page}"
+''' Functions for scraping data in HTML using lxml XPath - START '''
 
-    # Html request handling
-    html_try = 0
-    html_success = False
+# Compiled once - the page is parsed to a single lxml tree and every field is a C level XPath query over it,
+# instead of building a BeautifulSoup tree and walking it from the root for each field.
+# Exact @class matches a multi-class string like bs class_, has_class matches one class out of many like bs class_
 
-    while not html_success and html_try < 4:
+
+def _has_class(name: str):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+XP_POSITIONS = etree.XPath("//span[@class='Table_tag__3Mxk9 generated_utility3sm__0pg6W generated_utility1lg__ECKe_']")
+XP_OVR = etree.XPath(f"(//*[{_has_class('Table_statCellValue____Twu')}])[1]")
+XP_NAME = etree.XPath(f"(//*[{_has_class('Table_profileCellAnchor__VU0JH')}])[1]")
+XP_STATS = etree.XPath("//div[@class='Stat_stat__lh90p generated_utility2__1zAUs']")
+XP_LABEL_PARENT = etree.XPath("(//text()[. = $label])[1]/..")  # Parent tag of a label string, as bs .parent
+XP_FIRST_SPAN = etree.XPath("(.//span)[1]")
+XP_PLAYSTYLE_TAGS = etree.XPath("//div[@class='DetailedView_detailsItem__ZwdcY']")
+XP_PLAYSTYLES = etree.XPath(".//div[@class='IconAttribute_attribute__KTIK0 generated_utility2__1zAUs']")
+
+
+@log_err_set
+def xp_positions(root):
+    return {position.text_content() for position in XP_POSITIONS(root)}
+
+
+@log_err_num
+def xp_ovr(root):
+    return XP_OVR(root)[0].text_content()
+
+
+@log_err_str
+def xp_name(root):
+    return XP_NAME(root)[0].text_content()
+
+
+@log_err_dict
+def xp_stats(root):
+    temp_dict = {}
+    for stats in XP_STATS(root):
+        stats_text = stats.text_content()
+        stat_name = re.search('[A-Za-z]+', stats_text)[0]
+        stat_name_formatted = f"_{stat_name[0:3].lower()}"  # formatted for class "player" needs
+        temp_dict[stat_name_formatted] = int(re.search('[0-9]+', stats_text)[0])
+    return temp_dict
+
+
+@log_err_str
+def xp_att_wr(root):
+    return XP_LABEL_PARENT(root, label='ATT WORK RATE')[0].text_content()[13:]
+
+
+@log_err_str
+def xp_def_wr(root):
+    return XP_LABEL_PARENT(root, label='DEF WORK RATE')[0].text_content()[13:]
+
+
+@log_err_num
+def xp_wf(root):
+    return XP_FIRST_SPAN(XP_LABEL_PARENT(root, label='WEAK FOOT')[0])[0].get('aria-label')[0]
+
+
+@log_err_num
+def xp_skills(root):
+    return XP_FIRST_SPAN(XP_LABEL_PARENT(root, label='SKILL MOVES')[0])[0].get('aria-label')[0]
+
+
+@log_err_ps
+def xp_playstyles(root):
+    playstyle_tags = XP_PLAYSTYLE_TAGS(root)
+
+    if len(playstyle_tags) == 2:  # Player has a PlayStyle Plus
+        temp_playstyle_plus = XP_PLAYSTYLES(playstyle_tags[0])[0].text_content()
+        playstyles_class = XP_PLAYSTYLES(playstyle_tags[1])
+
+    elif len(playstyle_tags) == 1:  # No PlayStyle Plus but found PlayStyles
+        temp_playstyle_plus = 'None'
+        playstyles_class = XP_PLAYSTYLES(playstyle_tags[0])
+
+    else:
+        temp_playstyle_plus = 'None'
+        playstyles_class = []
+
+    temp_playstyles = {playstyle.text_content() for playstyle in playstyles_class}
+
+    return temp_playstyles, temp_playstyle_plus
+
+
+# Field scraping functions of each parser
+BS_SCRAPERS = {'positions': scrape_positions, 'ovr': scrape_ovr, 'name': scrape_name, 'stats': scrape_stats,
+               'att_wr': scrape_att_wr, 'def_wr': scrape_def_wr, 'wf': scrape_wf, 'skills': scrape_skills,
+               'playstyles': scrape_playstyles}
+XP_SCRAPERS = {'positions': xp_positions, 'ovr': xp_ovr, 'name': xp_name, 'stats': xp_stats, 'att_wr': xp_att_wr,
+               'def_wr': xp_def_wr, 'wf': xp_wf, 'skills': xp_skills, 'playstyles': xp_playstyles}
+
+''' Functions for scraping data in HTML using lxml XPath - END '''
+
+
+''' Concurrent scraping pipeline - START '''
+
+BASE_URL = "https://www.ea.com"
+RATINGS_PATH = "/games/ea-sports-fc/ratings?page={page}"
+LAST_PAGE = 174
+RETRY_STATUSES = (429, 500, 502, 503, 504)  # Responses of an overloaded or failing server - retried after a backoff
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                         'Chrome/91.0.4472.124 Safari/537.36'}
+
+
+# Limits the rate of requests per host - shared by all the scraping threads
+class RateLimiter:
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0  # Minimal seconds between two requests to a host
+        self.next_time = {}  # Host: time its next request is allowed
+        self.lock = threading.Lock()
+
+    # Blocks until the next request to the url host is allowed
+    def wait(self, url: str):
+        host = urlsplit(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            next_time = max(now, self.next_time.get(host, 0))
+            self.next_time[host] = next_time + self.interval
+        if next_time > now:
+            time.sleep(next_time - now)
+
+    # Holds all the requests to the url host for delay seconds - a server asking to slow down is slowed down for
+    # all the threads, not only for the one that got the answer
+    def defer(self, url: str, delay: float):
+        host = urlsplit(url).netloc
+        with self.lock:
+            self.next_time[host] = max(self.next_time.get(host, 0), time.monotonic() + delay)
+
+
+# Session with pooled keep-alive connections. No retries in the connection adapter - fetch retries, so every retry
+# goes through the rate limiter like any other request
+def make_session(pool_size: int):
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# On disk cache of the scraped responses - per url its ETag/Last-Modified validators, content hash and the data
+# scraped from it, so unchanged pages are not parsed again
+class ResponseCache:
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.parsed = 0  # Responses parsed in this run - new or changed content
+        self.reused = 0  # Responses whose cached data was reused
+
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def get(self, url: str):
+        return self.entries.get(url)
+
+    # Stores the entry of a parsed response
+    def put(self, url: str, entry: dict):
+        with self.lock:
+            self.entries[url] = entry
+            self.parsed += 1
+
+    # Returns the cached data of an unchanged response
+    def reuse(self, entry: dict):
+        with self.lock:
+            self.reused += 1
+        return entry['data']
+
+    # Writes the cache to disk - through a temp file, so a failed write keeps the previous cache
+    def save(self):
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.entries, f, default=sorted)  # Sets (positions, playstyles) are saved as lists
+        os.replace(self.path + '.tmp', self.path)
+
+
+# Seconds to wait before a retry - the Retry-After of the response when given in seconds, else exponential backoff
+def _retry_delay(response, attempt: int, backoff: float):
+    retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+    if retry_after.isdigit():
+        return float(retry_after)
+    return backoff * 2 ** attempt
+
+
+# Html request handling - returns the data scraped from the url response by scrape(text), or None if the request
+# failed after all retries. Connection errors and RETRY_STATUSES responses are retried up to retries times, each
+# attempt waits for the rate limiter and a retry defers the whole host by the backoff delay. With a cache, a
+# conditional request is sent and the cached data is returned when the response is not modified or has the same
+# content hash. A failed request falls back to cached data if any
+def fetch(session: requests.Session, limiter: RateLimiter, url: str, scrape, cache=None, retries=4, backoff=1.0):
+    entry = cache.get(url) if cache is not None else None
+    headers = {}
+    if entry is not None:
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    for attempt in range(retries + 1):
+        limiter.wait(url)
         try:
-            html_try += 1
-            html = requests.get(url, headers=headers)
-            if html.status_code == 200:  # No exception
-                html_success = True
-        except requests.exceptions.RequestException:
-            logging.error(f"Failed attempt no. {html_try} for http request in page {page}")
-            time.sleep(2 ** html_try)  # Exponential backoff
+            html = session.get(url, headers=headers, timeout=30)
+        except requests.exceptions.RequestException as e:
+            html, error = None, e
+        else:
+            if html.status_code not in RETRY_STATUSES:
+                break
+            error = f"status {html.status_code}"
+
+        if attempt < retries:
+            limiter.defer(url, _retry_delay(html, attempt, backoff))
+    else:
+        logging.error(f"Http request to {url} failed after {retries + 1} attempts: {error}")
+        return entry['data'] if entry is not None else None
+
+    if html.status_code == 304 and entry is not None:  # Not modified
+        return cache.reuse(entry)
 
-    if not html_success:
-        logging.error(f"Http request in page {page} failed. Skipping to the next page.")
-        continue
+    if html.status_code != 200:
+        logging.error(f"Http request to {url} failed with status {html.status_code}")
+        return entry['data'] if entry is not None else None
 
-    soup = bs(html.text, features="lxml")
+    content_hash = hashlib.sha1(html.content).hexdigest()
+    if entry is not None and entry['hash'] == content_hash:  # Same content, validators not supported by server
+        return cache.reuse(entry)
 
+    data = scrape(html.text)
+    if cache is not None:
+        cache.put(url, {'etag': html.headers.get('ETag'), 'last_modified': html.headers.get('Last-Modified'),
+                        'hash': content_hash, 'data': data})
+
+    return data
+
+
+# Scrape the players profile links of a ratings page - returns None for a page without the players table (e.g. a
+# maintenance page), like a failed request
+def scrape_profile_links(page_html: str, base_url: str):
+    soup = bs(page_html, features="lxml")
     table = soup.find('tbody', class_='Table_tbody__gYqSw')
-    for link in table.findAll('a', class_='Table_profileCellAnchor__VU0JH'):
-        player_link = absolute + link['href']
-        player_dict = {}
-        player_html = requests.get(player_link)
-        player_soup = bs(player_html.text, features="lxml")
+    if table is None:
+        logging.error("No players table in the ratings page")
+        return None
+
+    return [base_url + link['href'] for link in table.findAll('a', class_='Table_profileCellAnchor__VU0JH')]
+
+
+# Scrape a player profile page - returns the player data as a dict, or None for goalkeepers.
+# fast - parse with lxml XPath instead of BeautifulSoup
+def scrape_player(player_html: str, fast=False):
+    if fast:
+        page, scrapers = lxml_html.document_fromstring(player_html), XP_SCRAPERS
+    else:
+        page, scrapers = bs(player_html, features="lxml"), BS_SCRAPERS
+
+    # Get Positions
+    positions = scrapers['positions'](page)
+
+    # Not interested in Goalkeepers
+    if 'GK' in positions:
+        return None
+
+    # Get overall
+    overall = scrapers['ovr'](page)
+
+    # Get name of player
+    name = scrapers['name'](page)
+
+    # Get player general stats
+    stat_dict = scrapers['stats'](page)
+
+    # Get attacking workrate
+    att_work_rate = scrapers['att_wr'](page)
+
+    # Get defensive workrate
+    def_work_rate = scrapers['def_wr'](page)
+
+    # Get weak foot
+    weak_foot = scrapers['wf'](page)
+
+    # Get skill moves
+    skill_moves = scrapers['skills'](page)
+
+    # Get PlayStyles
+    playstyles, playstyle_plus = scrapers['playstyles'](page)
+
+    # Update dictionary
+    player_dict = {'name': name}
+
+    player_dict.update(stat_dict)
+
+    player_dict.update({
+        '_ovr': overall,
+        'skills': skill_moves,
+        'wf': weak_foot,
+        'positions': positions,
+        'playstyle_plus': playstyle_plus,
+        'playstyles': playstyles,
+        'att_wr': att_work_rate,
+        'def_wr': def_work_rate
+    })
+
+    return player_dict
+
+
+# Fetch and scrape a player profile - runs in a scraping thread
+def fetch_player(session: requests.Session, limiter: RateLimiter, player_link: str, cache=None, fast=True):
+    player_dict = fetch(session, limiter, player_link, lambda player_html: scrape_player(player_html, fast), cache)
+    if player_dict is None:
+        return None
 
-        # Get Positions
-        positions = scrape_positions(player_soup)
+    # Cached players have their sets as lists
+    return dict(player_dict, positions=set(player_dict['positions']), playstyles=set(player_dict['playstyles']))
 
-        # Not interested in Goalkeepers
-        if 'GK' in positions:
-            continue
 
-        # Get overall
-        overall = scrape_ovr(player_soup)
+# Scrape all the ratings pages and their players profiles concurrently, and write all the players to out_csv at once.
+# workers - bounded number of concurrent requests over pooled connections, rate - max requests per second to a
+# host (None - no limit). The default rate gets the ~17k pages (174 ratings pages and their profiles) in about five
+# minutes. Failed requests are retried within the rate, and a server answering 429 or 5xx slows all the threads
+# down (see fetch) - a lower rate is kinder to the server at the cost of a longer run. base_url may point to a
+# local HTTP stand-in serving saved pages. cache_path - the response cache file, only changed pages are parsed again
+# (None - no cache). fast - parse profiles with lxml XPath
+def scrape_all(base_url=BASE_URL, pages=range(1, LAST_PAGE + 1), workers=16, rate=60.0,
+               out_csv='eafc_players_new.csv', cache_path='scrape_cache.json', fast=True):
+    session = make_session(workers)
+    limiter = RateLimiter(rate)
+    cache = ResponseCache(cache_path) if cache_path is not None else None
 
-        # Get name of player
-        name = scrape_name(player_soup)
+    def scrape_links(page_html):
+        return scrape_profile_links(page_html, base_url)
 
-        # Get player general stats
-        stat_dict = scrape_stats(player_soup)
+    players = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Ratings pages are requested first, each page players profiles are queued as soon as the page arrives
+            page_urls = [base_url + RATINGS_PATH.format(page=page) for page in pages]
+            page_futures = [pool.submit(fetch, session, limiter, page_url, scrape_links, cache)
+                            for page_url in page_urls]
 
-        # Get attacking workrate
-        att_work_rate = scrape_att_wr(player_soup)
+            player_futures = []
+            for page_url, page_future in zip(page_urls, page_futures):
+                player_links = page_future.result()
+                if player_links is None:
+                    logging.error(f"Http request in page {page_url} failed. Skipping to the next page.")
+                    continue
 
-        # Get defensive workrate
-        def_work_rate = scrape_def_wr(player_soup)
+                player_futures += [pool.submit(fetch_player, session, limiter, player_link, cache, fast)
+                                   for player_link in player_links]
 
-        # Get weak foot
-        weak_foot = scrape_wf(player_soup)
+            for player_future in player_futures:  # Ratings order
+                player_dict = player_future.result()
+                if player_dict is None:  # Goalkeeper or failed request
+                    continue
 
-        # Get skill moves
-        skill_moves = scrape_skills(player_soup)
+                players.append(player_dict)
+    finally:  # An unexpected error keeps the players and pages scraped so far
+        # Write all the players data as rows at once
+        pd.DataFrame(players).to_csv(out_csv, index=False)
+        print(f"Succeeded to scrape {len(players)} players")
 
-        # Get PlayStyles
-        playstyles, playstyle_plus = scrape_playstyles(player_soup)
+        if cache is not None:
+            cache.save()
+            print(f"Parsed {cache.parsed} new or changed pages, reused {cache.reused} unchanged pages")
 
-        # Update dictionary
-        player_dict.update({'name': name})
 
-        player_dict.update(stat_dict)
+''' Concurrent scraping pipeline - END '''
 
-        player_dict.update({
-            '_ovr': overall,
-            'skills': skill_moves,
-            'wf': weak_foot,
-            'positions': positions,
-            'playstyle_plus': playstyle_plus,
-            'playstyles': playstyles,
-            'att_wr': att_work_rate,
-            'def_wr': def_work_rate
-        })
 
-        # Append to a CSV the new player data as a row
-        pd.DataFrame([player_dict]).to_csv('eafc_players_new.csv', mode='a', header=False, index=False)
-        print(f"Succeeded to scrape: {player_dict['name']}")
+# Compares the lxml XPath and the BeautifulSoup scraping of saved profile pages - returns the mismatching files
+def check_parity(paths: list):
+    mismatches = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            player_html = f.read()
+
+        bs_player, fast_player = scrape_player(player_html), scrape_player(player_html, fast=True)
+        if bs_player != fast_player:
+            logging.error(f"Parsers mismatch in {path}:\n bs:   {bs_player}\n lxml: {fast_player}")
+            mismatches.append(path)
+
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Scrape EA FC 24 players ratings")
+    parser.add_argument('--parity', nargs='+', metavar='HTML_FILE',
+                        help="check the fast parser against BeautifulSoup over saved profile pages and exit "
+                             "(fixtures/profiles/*.html are synthetic pages, not saved ones)")
+    args = parser.parse_args()
+
+    if args.parity:
+        failed = check_parity(args.parity)
+        print(f"{len(args.parity) - len(failed)}/{len(args.parity)} profile pages parsed the same")
+        sys.exit(1 if failed else 0)
+
+    scrape_all()
@@ -0,0 +1,426 @@
+import argparse
+import heapq
+import itertools
+import random
+import sys
+import time
+from utils import STATS, MAX_STAT, MAX_STARS, positions_mask, playstyles_mask
+
+# Evolution path search engine - expands every reachable evolved state of a player only once
+
+
+# Remaining evolutions of a player, a stackable one once for each time he may still do it - for the best case bounds
+def with_repeats(_player, remaining: list):
+    if all(evolution.repeat == 1 for evolution in remaining):
+        return remaining
+    return [evolution for evolution in remaining for _ in range(evolution.times_left(_player))]
+
+
+# Best case bound of the players reachable from a search node under the wanted conditions.
+# Gets the same conditions as Player.eval_cond, the search prunes subtrees that can't meet them
+class CondBound:
+    def __init__(self, evo_list: list, **kwargs):
+        self.evo_list = evo_list
+        self.name = kwargs.get('name', '')
+        self.min_stats = tuple(kwargs.get(f"min{stat}", 0) for stat in STATS)  # STATS order
+        self.min_skills = kwargs.get('min_skills', 0)
+        self.min_wf = kwargs.get('min_wf', 0)
+        wanted_positions = kwargs.get('wanted_positions')  # Bitmasks - None, no condition
+        self.wanted_positions = None if wanted_positions is None else positions_mask(frozenset(wanted_positions))
+        self.playstyle_plus = kwargs.get('playstyle_plus', '')
+        wanted_playstyles = kwargs.get('wanted_playstyles')
+        self.wanted_playstyles = None if wanted_playstyles is None else playstyles_mask(frozenset(wanted_playstyles))
+        self.att_wr = kwargs.get('att_wr', '')
+        self.def_wr = kwargs.get('def_wr', '')
+        self.wanted_evos = kwargs.get('wanted_evos')
+        self.stat_idx = [i for i, min_stat in enumerate(self.min_stats) if min_stat]  # Only the wanted stats
+
+        # No conditions at all - nothing to prune
+        self.active = any(val not in ('', 0, None) for val in kwargs.values())
+
+    # Checks if a player, or any player evolved from him, may meet the conditions. Stats, stars, positions and
+    # playstyles are bounded by doing all the remaining evolutions - the ones the player is not blocked from
+    def reachable(self, _player, stats: tuple, remaining: list):
+        return self.reachable_by(_player, stats, with_repeats(_player, remaining))
+
+    # Same as reachable, with the remaining evolutions already repeated as many times as the player may still do them
+    def reachable_by(self, _player, stats: tuple, remaining: list):
+        if self.name != '' and self.name not in _player.name:
+            return False
+
+        if self.wanted_evos is not None:  # A desired evolution is done or may still be done
+            if set(self.wanted_evos).isdisjoint(_player.evolutions + tuple(remaining)):
+                return False
+
+        for i in self.stat_idx:
+            best_stat = stats[i] + sum(evolution.upg_stats[i] for evolution in remaining)
+            if min(best_stat, MAX_STAT) < self.min_stats[i]:
+                return False
+
+        if self.min_skills and (min(_player.skills + sum(evolution.upg.get('skills', 0) for evolution in remaining),
+                                    MAX_STARS) < self.min_skills):
+            return False
+
+        if self.min_wf and (min(_player.wf + sum(evolution.upg.get('wf', 0) for evolution in remaining),
+                                MAX_STARS) < self.min_wf):
+            return False
+
+        if self.wanted_positions is not None and not self.wanted_positions & _player.positions:
+            if not any(self.wanted_positions & evolution.upg_positions for evolution in remaining):
+                return False
+
+        if self.wanted_playstyles is not None and not self.wanted_playstyles & _player.playstyles:
+            if not any(self.wanted_playstyles & evolution.upg_playstyles for evolution in remaining):
+                return False
+
+        if self.playstyle_plus != '' and self.playstyle_plus != _player.playstyle_plus:
+            if _player.playstyle_plus != "None":  # Playstyle plus is only granted to players with none
+                return False
+            if all(evolution.upg.get('playstyle_plus') != self.playstyle_plus for evolution in remaining):
+                return False
+
+        for wr_name, wanted_wr in (('att_wr', self.att_wr), ('def_wr', self.def_wr)):
+            if wanted_wr != '' and wanted_wr != getattr(_player, wr_name):
+                if all(evolution.upg.get(wr_name) != wanted_wr for evolution in remaining):
+                    return False
+
+        return True
+
+
+# Limits of a search - wall time in seconds and number of search nodes, None - no limit. A budget starts on its first
+# use, and may be shared by many searches as a global budget
+class SearchBudget:
+    def __init__(self, max_time=None, max_nodes=None):
+        self.max_time = max_time
+        self.max_nodes = max_nodes
+        self.deadline = None
+        self.nodes = 0  # Search nodes spent
+
+    def start(self):
+        if self.deadline is None and self.max_time is not None:
+            self.deadline = time.monotonic() + self.max_time
+
+    def exhausted(self):
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            return True
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+
+class PathSearch:
+    # max_time, max_nodes - limits of the search of each base player, max_depth - limit of the path length.
+    # budget - a SearchBudget shared by the searches of all the base players. Gets the conditions of Player.eval_cond.
+    # prefixes - every evolved player on the way meeting the conditions is found, not only the path ends. max_depth
+    # is then a cap of the paths - the players up to it are all found, so a capped path doesn't truncate the search
+    def __init__(self, evo_list: list, max_time=None, max_nodes=None, max_depth=None, budget=None, prefixes=False,
+                 **kwargs):
+        self.evo_list = evo_list  # Evolutions to search in
+        self.cond = kwargs  # Conditions for the evolved players (see Player.eval_cond)
+        self.bound = CondBound(evo_list, **kwargs)
+        self.max_time = max_time
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.budget = budget
+        self.prefixes = prefixes
+        self.truncated = []  # Base players whose search was cut by a limit - their found players are partial
+
+    # Runs the search from a base player - adds the evolved players at the end of a path that meet the conditions.
+    # Returns False if the search was cut by a limit
+    def run(self, base_player, player_set: set):
+        truncated = len(self.truncated)
+        player_set.update(self.iter_paths(base_player))
+        return len(self.truncated) == truncated
+
+    # Checks if the global budget is spent - no base player can be searched anymore
+    def exhausted(self):
+        return self.budget is not None and self.budget.exhausted()
+
+    # Yields the evolved players at the end of a path (or on the way, in prefixes mode) that meet the conditions,
+    # each one as soon as it is found. The path of an evolved player is his evolutions tuple. Players are equal by
+    # state key, and each state is expanded once, so no player is yielded twice - a state shared by many prefixes
+    # is found once. The search is depth first over an explicit stack, so paths are not bounded by the interpreter
+    # recursion limit. Once a limit is hit the search stops, the base player is flagged as truncated and only the
+    # players found until then are yielded
+    def iter_paths(self, base_player):
+        expanded = set()  # Transposition table - state keys of the already expanded states
+        player_budget = SearchBudget(self.max_time, self.max_nodes)
+        player_budget.start()
+        if self.budget is not None:
+            self.budget.start()
+
+        stack = [(None, base_player)]  # Evolution to do and player to do it on - evolved only when popped
+        while stack:
+            if player_budget.exhausted() or self.exhausted():
+                self._truncate(base_player)
+                return
+            player_budget.nodes += 1
+            if self.budget is not None:
+                self.budget.nodes += 1
+
+            evolution, _player = stack.pop()
+            if evolution is not None:
+                _player = self._evolve(evolution, _player)
+
+            avail_evos = self._expand(_player, expanded)
+            if avail_evos is None:  # Already expanded or pruned
+                continue
+
+            if not avail_evos or self.prefixes:  # Path end (no available evolution) or any state in prefixes mode
+                if _player.evolutions and _player.eval_cond(**self.cond):  # Evolved player and conditions met for him
+                    yield _player
+
+            if not avail_evos:
+                continue
+            if self.max_depth is not None and len(_player.evolutions) >= self.max_depth:  # Longer paths are cut
+                if not self.prefixes:
+                    self._truncate(base_player)
+            else:
+                stack.extend((avail_evo, _player) for avail_evo in reversed(avail_evos))  # Popped in list order
+
+    def _truncate(self, base_player):
+        if not self.truncated or self.truncated[-1] is not base_player:
+            self.truncated.append(base_player)
+
+    def _evolve(self, evolution, _player):
+        return evolution.evolve(_player)
+
+    # Expands a state once - returns the evolutions available to the player, None if the state was already expanded
+    # (reached again by a different order of the same evolutions) or its subtree can't meet the conditions
+    def _expand(self, _player, expanded: set):
+        key = _player.state_key()
+        if key in expanded:  # Same state and same evolutions multiset already searched
+            return None
+        expanded.add(key)
+
+        evos = self._player_evos(_player)
+        return None if evos is None else evos[1]
+
+    # Returns the evolutions the player may still do, now or later, and the ones available to him now.
+    # None if the conditions are out of reach from the player
+    def _player_evos(self, _player):
+        stats = _player.stat_vector()
+        pos_mask = _player.positions
+        remaining = [evolution for evolution in self.evo_list
+                     if not evolution.req_check.blocked(_player, stats, pos_mask)]
+        if self.bound.active and not self.bound.reachable(_player, stats, remaining):
+            return None
+
+        return remaining, [evolution for evolution in remaining if evolution.req_check.ready(_player, stats, pos_mask)]
+
+
+# Objective of the optimal paths search - minimum total coin cost (Evo.price) of the path.
+# Prices are never negative, so the cost of a path only grows and the search is Dijkstra's
+class CostObjective:
+    # Score to maximize - the negated cost
+    def score(self, _player):
+        return -sum(evolution.price for evolution in _player.evolutions)
+
+    # Best score of any player evolved from _player, with the evolutions he may still do
+    def bound(self, _player, remaining: list):
+        return self.score(_player)
+
+
+# Objective of the optimal paths search - maximum weighted sum of stats, e.g. {'_ovr': 1} for the highest overall
+class StatObjective:
+    def __init__(self, weights: dict):
+        for stat, weight in weights.items():
+            if stat not in STATS or weight < 0:  # A negative weight would break the bound
+                raise ValueError(f"Unsupported stat weight {stat}: {weight}")
+        self.weights = [(i, weights.get(stat, 0)) for i, stat in enumerate(STATS) if weights.get(stat, 0)]
+
+    def score(self, _player):
+        stats = _player.stat_vector()
+        return sum(weight * stats[i] for i, weight in self.weights)
+
+    # Best score of any player evolved from _player. A stat is bounded by doing all the evolutions he may still do,
+    # and by the max requirement of the last evolution raising it - that evolution is done with the stat at most at
+    # its max, so the stat ends at most at the max plus the upgrade
+    def bound(self, _player, remaining: list):
+        stats = _player.stat_vector()
+        remaining = with_repeats(_player, remaining)
+        best = 0
+        for i, weight in self.weights:
+            raising = [evolution for evolution in remaining if evolution.upg_stats[i]]
+            if raising:
+                best_stat = min(stats[i] + sum(evolution.upg_stats[i] for evolution in raising), MAX_STAT,
+                                max(evolution.req_check.max_stats[i] + evolution.upg_stats[i] for evolution in raising))
+                best += weight * max(best_stat, stats[i])
+            else:
+                best += weight * stats[i]
+        return best
+
+
+# Objective of a query - 'cost', a stat name for its maximum, or a dict of stats weights for their maximum weighted sum
+def make_objective(objective):
+    if objective == 'cost':
+        return CostObjective()
+    if isinstance(objective, str):
+        return StatObjective({objective: 1})
+    if isinstance(objective, dict):
+        return StatObjective(objective)
+    return objective  # Already an objective
+
+
+# Best-first search of the top k evolved players of a base player by an objective, among the players PathSearch
+# finds (path ends, or all the states in prefixes mode, meeting the conditions). Each search node is queued by the
+# best score any player evolved from it may get, and a found player by his own score - a found player popped first
+# beats every queued one, so the optimum is proven with no other path enumerated. Gets the limits and conditions of
+# PathSearch
+class OptimalPathSearch(PathSearch):
+    def __init__(self, evo_list: list, objective='cost', top_k=1, **kwargs):
+        super().__init__(evo_list, **kwargs)
+        self.objective = make_objective(objective)
+        self.top_k = top_k
+
+    # Yields the top k evolved players of the base player, best first
+    def iter_paths(self, base_player):
+        expanded = set()
+        player_budget = SearchBudget(self.max_time, self.max_nodes)
+        player_budget.start()
+        if self.budget is not None:
+            self.budget.start()
+
+        # Heap of (negated score bound, 0 - found player or 1 - search node, negated insertion order, player, his
+        # available evolutions) - on equal scores found players are popped first, then the last queued nodes, so the
+        # search dives to a path end instead of expanding all the nodes of a tied score
+        queue = []
+        order = itertools.count(0, -1)
+        self._push(queue, order, base_player, expanded)
+        found = 0
+        while queue and found < self.top_k:
+            if player_budget.exhausted() or self.exhausted():
+                self._truncate(base_player)
+                return
+            player_budget.nodes += 1
+            if self.budget is not None:
+                self.budget.nodes += 1
+
+            _, node, _, _player, avail_evos = heapq.heappop(queue)
+            if not node:  # Found player - no queued player can score better
+                found += 1
+                yield _player
+                continue
+
+            if not avail_evos or self.prefixes:  # Path end or any state in prefixes mode - queued again by his score
+                if _player.evolutions and _player.eval_cond(**self.cond):
+                    heapq.heappush(queue, (-self.objective.score(_player), 0, next(order), _player, None))
+
+            if not avail_evos:
+                continue
+            if self.max_depth is not None and len(_player.evolutions) >= self.max_depth:
+                if not self.prefixes:
+                    self._truncate(base_player)
+            else:
+                for avail_evo in avail_evos:
+                    self._push(queue, order, self._evolve(avail_evo, _player), expanded)
+
+    # Queues a state once, by the best score of the players evolved from it
+    def _push(self, queue: list, order, _player, expanded: set):
+        key = _player.state_key()
+        if key in expanded:  # A state's bound depends on the state only, so the first push is the only one needed
+            return
+        expanded.add(key)
+
+        evos = self._player_evos(_player)
+        if evos is not None:
+            remaining, avail_evos = evos
+            heapq.heappush(queue, (-self.objective.bound(_player, remaining), 1, next(order), _player, avail_evos))
+
+
+# Streams the evolved players meeting the conditions (see Player.eval_cond) out of base players, each one as soon
+# as it is found. Stops early after limit evolved players or once time_budget seconds have passed (checked between
+# found players and between base players), or once the global budget of the search is spent (see PathSearch).
+# truncated - a list the base players whose search was cut by a limit are added to.
+# objective - only the top_k best evolved players of each base player by it are yielded (see OptimalPathSearch).
+# base_players may be a lazy iterable, so no result set is held in memory
+def iter_evolved_players(base_players, evo_list: list, limit=None, time_budget=None, truncated=None, objective=None,
+                         top_k=1, **kwargs):
+    if objective is None:
+        search = PathSearch(evo_list, **kwargs)
+    else:
+        search = OptimalPathSearch(evo_list, objective, top_k, **kwargs)
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    found = 0
+
+    try:
+        for base_player in base_players:
+            if search.exhausted():
+                return
+
+            for evo_player in search.iter_paths(base_player):
+                yield evo_player
+                found += 1
+                if limit is not None and found >= limit:
+                    return
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
+
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+    finally:
+        if truncated is not None:
+            truncated.extend(search.truncated)
+
+
+# Conditions sets of the search check - stats, stars, positions, playstyles, playstyle plus, work rates and name
+CHECK_CONDS = [{'min_skills': 4}, {'min_ovr': 80, 'wanted_positions': {'CM', 'CAM'}}, {'playstyle_plus': 'INTERCEPT'},
+               {'min_pac': 80, 'min_wf': 4}, {'wanted_playstyles': {'TRIVELA'}, 'att_wr': 'High'},
+               {'name': 'a', 'min_dri': 75, 'def_wr': 'Medium'}]
+
+
+# Every evolved player at the end of a path of the base player (every one on the way in prefixes mode, with paths
+# capped at max_depth), by trying every order of the available evolutions - no pruning and no transposition table.
+# Exponential, for checking the search only
+def brute_force_paths(base_player, evo_list: list, prefixes=False, max_depth=None):
+    found = {}  # By state key
+    stack = [base_player]
+    while stack:
+        _player = stack.pop()
+        avail_evos = _player.get_avail_evos(evo_list)
+        if (not avail_evos or prefixes) and _player.evolutions:
+            found[_player.state_key()] = _player
+        if max_depth is None or len(_player.evolutions) < max_depth:
+            stack.extend(evolution.evolve(_player) for evolution in avail_evos)
+
+    return list(found.values())
+
+
+# Checks the pruned search against the brute force over the base players - each conditions set must find exactly
+# the brute force players meeting it, once each. Gets the prefixes and max_depth of PathSearch. Returns the
+# mismatching (conditions, base player name) pairs
+def check_search(base_players, evo_list: list, conds=CHECK_CONDS, prefixes=False, max_depth=None):
+    searches = [PathSearch(evo_list, prefixes=prefixes, max_depth=max_depth, **cond) for cond in conds]
+    mismatches = []
+    for base_player in base_players:
+        brute = brute_force_paths(base_player, evo_list, prefixes, max_depth)
+        for cond, search in zip(conds, searches):
+            found = [evo_player.state_key() for evo_player in search.iter_paths(base_player)]
+            if sorted(found) != sorted(evo_player.state_key() for evo_player in brute if evo_player.eval_cond(**cond)):
+                mismatches.append((cond, base_player.name))
+
+    return mismatches
+
+
+if __name__ == '__main__':
+    # Checks the search pruning (CondBound), and the prefixes mode with and without a paths cap, against the brute
+    # force over sampled players of the players database
+    from dataset import load_players
+    from evo import curr_evos
+
+    parser = argparse.ArgumentParser(description="Check the pruned evolution paths search against a brute force")
+    parser.add_argument('--players', type=int, default=400, help="number of sampled base players")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the players sample")
+    args = parser.parse_args()
+
+    table = load_players('eafc_players_final.csv')
+    rows = random.Random(args.seed).sample(range(len(table)), min(args.players, len(table)))
+    conds = CHECK_CONDS + [{'wanted_evos': curr_evos[:2]}]
+    modes = ({}, {'prefixes': True}, {'prefixes': True, 'max_depth': 2})
+    failed = []
+    for mode in modes:
+        for cond, name in check_search((table.player(i) for i in rows), curr_evos, conds, **mode):
+            print(f"Search and brute force mismatch for {name}: {cond} {mode}")
+            failed.append(name)
+
+    n_checks = len(rows) * len(conds) * len(modes)
+    print(f"{n_checks - len(failed)}/{n_checks} searches found the brute force players")
+    sys.exit(1 if failed else 0)
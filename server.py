@@ -0,0 +1,192 @@
+import argparse
+import inspect
+import json
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dataset import load_players
+from player import Player
+from prefilter import filter_players
+from search import iter_evolved_players
+from utils import STATS, POSITIONS, PLAYSTYLES, positions_set, playstyles_set
+
+'''
+Local query service - a long running HTTP/JSON server that keeps the players table and the compiled evolutions
+resident, so a query costs only its search. Queries are normalized (default conditions dropped, sets and evolution
+names sorted) and their responses are kept in an LRU cache, so a repeated query is served with no search at all.
+
+POST /query   {"evos": [names, default all], "cond": {Player.eval_cond conditions}, "objective": ..., "top_k": 1}
+GET  /health  GET /stats (cache counters)
+'''
+
+COND_DEFAULTS = {name: param.default for name, param in inspect.signature(Player.eval_cond).parameters.items()
+                 if name != 'self'}
+SET_CONDS = {'wanted_positions': POSITIONS, 'wanted_playstyles': PLAYSTYLES}  # Names allowed in each one
+
+
+# Checks a value is an int - bool is an int subclass, but never a count or a stat
+def _is_int(val):
+    return isinstance(val, int) and not isinstance(val, bool)
+
+
+# Checks a value is a list of str
+def _is_str_list(val):
+    return isinstance(val, list) and all(isinstance(item, str) for item in val)
+
+
+# JSON record of an evolved player
+def player_to_dict(_player):
+    return {'name': _player.name, 'ovr': _player._ovr, 'pac': _player._pac, 'sho': _player._sho,
+            'pas': _player._pas, 'dri': _player._dri, 'def': _player._def, 'phy': _player._phy,
+            'skills': _player.skills, 'wf': _player.wf, 'positions': sorted(positions_set(_player.positions)),
+            'playstyle_plus': _player.playstyle_plus, 'playstyles': sorted(playstyles_set(_player.playstyles)),
+            'att_wr': _player.att_wr, 'def_wr': _player.def_wr, 'rarity': _player.rarity,
+            'evolutions': [evolution.name for evolution in _player.evolutions],
+            'price': sum(evolution.price for evolution in _player.evolutions)}
+
+
+class QueryService:
+    def __init__(self, table, evo_list: list, cache_size=1024):
+        self.table = table
+        self.evo_by_name = {evolution.name: evolution for evolution in evo_list}
+        self._cached_query = lru_cache(maxsize=cache_size)(self._run)
+
+    # Normalized query key - equal queries get the same key, whatever their order, defaults or containers
+    def normalize(self, query: dict):
+        unknown = set(query) - {'evos', 'cond', 'objective', 'top_k'}
+        if unknown:
+            raise ValueError(f"Unknown query fields: {', '.join(sorted(unknown))}")
+
+        evos = query.get('evos')
+        if evos is not None and not _is_str_list(evos):
+            raise ValueError("Field evos must be a list of evolution names")
+        evo_names = sorted(self.evo_by_name) if evos is None else sorted(set(evos))
+        for evo_name in evo_names:
+            if evo_name not in self.evo_by_name:
+                raise ValueError(f"Unknown evolution: {evo_name}")
+
+        query_cond = query.get('cond', {})
+        if not isinstance(query_cond, dict):
+            raise ValueError("Field cond must be an object of conditions")
+        cond = {}
+        for key, val in query_cond.items():
+            if key not in COND_DEFAULTS:
+                raise ValueError(f"Unknown condition: {key}")
+            if val == COND_DEFAULTS[key] and type(val) is type(COND_DEFAULTS[key]):
+                continue
+            if key.startswith('min'):
+                if not _is_int(val):
+                    raise ValueError(f"Condition {key} must be an int")
+            elif key in SET_CONDS or key == 'wanted_evos':
+                if not _is_str_list(val):
+                    raise ValueError(f"Condition {key} must be a list of names")
+                allowed = SET_CONDS.get(key, self.evo_by_name)
+                for item in val:
+                    if item not in allowed:
+                        raise ValueError(f"Unknown name in condition {key}: {item}")
+                val = sorted(set(val))
+            elif not isinstance(val, str):  # name, playstyle plus and work rates
+                raise ValueError(f"Condition {key} must be a string")
+            cond[key] = val
+
+        objective = query.get('objective')
+        if isinstance(objective, dict):
+            for stat, weight in objective.items():
+                if stat not in STATS or not isinstance(weight, (int, float)) or isinstance(weight, bool) or weight < 0:
+                    raise ValueError(f"Unsupported objective weight {stat}: {weight}")
+        elif objective is not None and objective != 'cost' and objective not in STATS:
+            raise ValueError(f"Unsupported objective: {objective}")
+        top_k = query.get('top_k', 1) if objective is not None else None
+        if objective is not None and (not _is_int(top_k) or top_k < 1):
+            raise ValueError("Field top_k must be a positive int")
+        return json.dumps({'evos': evo_names, 'cond': cond, 'objective': objective, 'top_k': top_k}, sort_keys=True)
+
+    # Response body of a normalized query - the whole JSON response is cached, a cache hit is only a lookup
+    def _run(self, key: str):
+        query = json.loads(key)
+        evo_list = [self.evo_by_name[evo_name] for evo_name in query['evos']]
+        cond = dict(query['cond'])
+        for set_cond in SET_CONDS:
+            if set_cond in cond:
+                cond[set_cond] = set(cond[set_cond])
+        if 'wanted_evos' in cond:
+            cond['wanted_evos'] = [self.evo_by_name[evo_name] for evo_name in cond['wanted_evos']]
+
+        start = time.perf_counter()
+        indices = filter_players(self.table, evo_list, **cond)
+        evolved_players = iter_evolved_players((self.table.player(i) for i in indices), evo_list,
+                                               objective=query['objective'], top_k=query['top_k'] or 1, **cond)
+        players = [player_to_dict(evo_player) for evo_player in evolved_players]
+        return json.dumps({'count': len(players), 'players': players,
+                           'search_ms': round((time.perf_counter() - start) * 1000, 3)}).encode()
+
+    def query(self, query: dict):
+        return self._cached_query(self.normalize(query))
+
+    def stats(self):
+        info = self._cached_query.cache_info()
+        return {'players': len(self.table), 'evos': sorted(self.evo_by_name), 'cache_hits': info.hits,
+                'cache_misses': info.misses, 'cache_size': info.currsize, 'cache_max_size': info.maxsize}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    service = None  # QueryService of the server, set by serve
+
+    def _reply(self, status: int, body: bytes):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._reply(200, b'{"status": "ok"}')
+        elif self.path == '/stats':
+            self._reply(200, json.dumps(self.service.stats()).encode())
+        else:
+            self._reply(404, b'{"error": "Not found"}')
+
+    def do_POST(self):
+        if self.path != '/query':
+            self._reply(404, b'{"error": "Not found"}')
+            return
+
+        try:
+            query = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(query, dict):
+                raise ValueError("The query must be a JSON object")
+            body = self.service.query(query)
+        except (ValueError, TypeError) as err:  # Bad JSON, field or condition value
+            self._reply(400, json.dumps({'error': str(err)}).encode())
+            return
+
+        self._reply(200, body)
+
+    def log_message(self, format, *args):  # Quiet - a log line per request would dominate cached queries
+        pass
+
+
+# Runs the query service until interrupted
+def serve(service: QueryService, host='127.0.0.1', port=8000):
+    QueryHandler.service = service
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    print(f"Serving {len(service.table)} players on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    from evo import curr_evos
+
+    parser = argparse.ArgumentParser(description="Serve evolution path queries over HTTP/JSON")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--cache-size', type=int, default=1024, help="number of query responses kept")
+    args = parser.parse_args()
+
+    serve(QueryService(load_players('eafc_players_final.csv'), curr_evos, args.cache_size), args.host, args.port)
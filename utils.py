@@ -1,9 +1,30 @@
-# Custom lists of evolutions equality check - checks same elements are equal regardless of order
-def are_evo_lists_equal(list1, list2):
-    if len(list1) != len(list2):
-        return False
+import hashlib
+import json
+from functools import lru_cache
 
-    return all(item in list2 for item in list1)
+MAX_STAT = 99
+MAX_STARS = 5
+
+# Player stats names - the order of the stat vectors used by the evolution requirements checks
+STATS = ('_ovr', '_pac', '_sho', '_pas', '_dri', '_def', '_phy')
+
+# Outfield positions in the game - each one is interned to a bit of a positions mask
+POSITIONS = ('ST', 'CF', 'LW', 'RW', 'CAM', 'LM', 'RM', 'CM', 'CDM', 'LWB', 'RWB', 'LB', 'RB', 'CB')
+POSITION_BITS = {pos: 1 << i for i, pos in enumerate(POSITIONS)}
+
+# PlayStyles in the game - each one is interned to a bit of a playstyles mask
+PLAYSTYLES = ('ACROBATIC', 'AERIAL', 'ANTICIPATE', 'BLOCK', 'BRUISER', 'CHIP SHOT', 'DEAD BALL', 'FINESSE SHOT',
+              'FIRST TOUCH', 'FLAIR', 'INCISIVE PASS', 'INTERCEPT', 'JOCKEY', 'LONG BALL PASS', 'LONG THROW',
+              'PINGED PASS', 'POWER HEADER', 'POWER SHOT', 'PRESS PROVEN', 'QUICK STEP', 'RAPID', 'RELENTLESS',
+              'SLIDE TACKLE', 'TECHNICAL', 'TIKI TAKA', 'TRICKSTER', 'TRIVELA', 'WHIPPED PASS')
+PLAYSTYLE_BITS = {ps: 1 << i for i, ps in enumerate(PLAYSTYLES)}
+
+# Hash of the positions and playstyles bits - kept with the stored bitmasks (players cache, paths index), which
+# are stale once a name is added or the order changes
+VOCABULARY_HASH = hashlib.sha1(json.dumps([POSITIONS, PLAYSTYLES]).encode()).hexdigest()
+
+# Attacking and defensive work rates in the game
+WORK_RATES = ('Low', 'Medium', 'High')
 
 
 # Parse str to set
@@ -14,6 +35,22 @@ def to_set(_str: str):
         return set(_str.split(','))
 
 
+# Parse str to a positions bitmask - every name must be in POSITIONS, a bit is never dropped from the data
+def to_positions_mask(_str: str):
+    unknown = to_set(_str).difference(POSITIONS)
+    if unknown:
+        raise ValueError(f"Unknown positions {sorted(unknown)} in '{_str}'")
+    return positions_mask(frozenset(to_set(_str)))
+
+
+# Parse str to a playstyles bitmask - every name must be in PLAYSTYLES
+def to_playstyles_mask(_str: str):
+    unknown = to_set(_str).difference(PLAYSTYLES)
+    if unknown:
+        raise ValueError(f"Unknown playstyles {sorted(unknown)} in '{_str}'")
+    return playstyles_mask(frozenset(to_set(_str)))
+
+
 # Get basic rarity (bronze, silver, gold) from ovr rating
 def get_rarity(_ovr: int):
     if _ovr >= 75:
@@ -23,3 +60,33 @@ def get_rarity(_ovr: int):
     else:
         return 'Bronze'
 
+
+# Get the bitmask of a positions set - cached, as only a few distinct positions sets exist. Names out of POSITIONS
+# (e.g. GK) set no bit: no player has them, so wanted positions made of them are never met
+@lru_cache(maxsize=None)
+def positions_mask(positions: frozenset):
+    mask = 0
+    for pos in positions:
+        mask |= POSITION_BITS.get(pos, 0)
+    return mask
+
+
+# Get the bitmask of a playstyles set - names out of PLAYSTYLES set no bit
+@lru_cache(maxsize=None)
+def playstyles_mask(playstyles: frozenset):
+    mask = 0
+    for ps in playstyles:
+        mask |= PLAYSTYLE_BITS.get(ps, 0)
+    return mask
+
+
+# Get the positions set of a positions bitmask
+@lru_cache(maxsize=None)
+def positions_set(mask: int):
+    return frozenset(pos for pos, bit in POSITION_BITS.items() if mask & bit)
+
+
+# Get the playstyles set of a playstyles bitmask
+@lru_cache(maxsize=None)
+def playstyles_set(mask: int):
+    return frozenset(ps for ps, bit in PLAYSTYLE_BITS.items() if mask & bit)